@@ -1,7 +1,290 @@
+import argparse
+import array
+import bisect
+import collections
+import csv
+import heapq
+import json
+import math
+import os
 import pygame
 import random
 import sys
+import threading
 import time
+import wave
+import zlib
+
+# NumPy is only needed for the array-backed projectile store, so the game still runs without it
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Bits used to describe the player's input on a single frame
+# LEFT and RIGHT move the ship, FIRE is a press of the space bar and RELEASE is the space bar being let go
+LEFT = 1
+RIGHT = 2
+FIRE = 4
+RELEASE = 8
+
+
+# The sound effects used in the game. Each entry holds the file, the volume, the priority and the maximum number of
+# copies of the sound that can play at once. Sounds with a higher priority can take a channel from a lower one
+SOUNDS = {
+    # The player's shots are quieter than the explosions but are never drowned out by the enemies
+    'friendly_fire': ('assets/friendly_fire.mp3', .6, 2, 2),
+    # The volume is low because there are lots of enemy projectiles fired per second
+    'enemy_fire': ('assets/enemy_fire.mp3', .15, 1, 3),
+    # Played when a projectile hits a ship
+    'explosion': ('assets/explosion.mp3', .3, 3, 3),
+}
+
+
+# Class that loads every sound effect once and plays them through a fixed number of mixer channels
+class SoundBank:
+    # Constructor for the SoundBank class. The bank is empty, and every sound is silently skipped, until it is loaded
+    # @param voices - The number of sounds that are allowed to play at the same time
+    def __init__(self, voices=8):
+        self.voices = voices
+        # Maps the name of each sound to the decoded sound, its priority and its limit
+        self.sounds = {}
+        # The channels the sound effects are played on
+        self.channels = []
+        # The name and priority of the sound last started on each channel
+        self.names = []
+        self.priorities = []
+
+    # Decodes every sound effect up front so nothing is read from disk while the game is being played
+    # @param decode - Function that returns the decoded sound in a file. pygame.mixer.Sound is used if it is not given
+    def load(self, decode=None):
+        # If there is no audio device the bank stays empty
+        if not pygame.mixer.get_init():
+            return
+        if decode is None:
+            decode = pygame.mixer.Sound
+        pygame.mixer.set_num_channels(self.voices)
+        sounds = {}
+        for name, (path, volume, priority, limit) in SOUNDS.items():
+            sound = decode(path)
+            sound.set_volume(volume)
+            sounds[name] = (sound, priority, limit)
+        # The bank can be loaded on another thread while sounds are being played, so the channels are all set up
+        # before any sound is added
+        self.channels = [pygame.mixer.Channel(i) for i in range(0, self.voices)]
+        self.names = [None] * self.voices
+        self.priorities = [0] * self.voices
+        self.sounds = sounds
+
+    # Plays a sound on a free channel, or takes the channel of a quieter priority sound if they are all in use
+    # @param name - The name of the sound in SOUNDS
+    def play(self, name):
+        if name not in self.sounds:
+            return None
+        sound, priority, limit = self.sounds[name]
+        free = None
+        victim = None
+        # The number of copies of this sound that are already playing
+        playing = 0
+        for i, channel in enumerate(self.channels):
+            if not channel.get_busy():
+                if free is None:
+                    free = i
+                continue
+            if self.names[i] == name:
+                playing += 1
+            # Remembers the busy channel with the lowest priority in case there are no free channels
+            if self.priorities[i] < priority and (victim is None or self.priorities[i] < self.priorities[victim]):
+                victim = i
+        # Drops the sound if too many copies of it are playing, so enemy fire can't take every channel
+        if playing >= limit:
+            return None
+        if free is None:
+            # Drops the sound if every channel is playing something at least as important
+            if victim is None:
+                return None
+            free = victim
+        self.names[free] = name
+        self.priorities[free] = priority
+        self.channels[free].play(sound)
+        return self.channels[free]
+
+
+# Class that keeps the images of recently rendered text so the same text never has to be rendered twice
+class TextCache:
+    # Constructor for the TextCache class
+    # @param size - The number of rendered pieces of text to keep. The least recently used ones are thrown away first
+    # @param font - The file of the font to render with
+    def __init__(self, size=256, font='freesansbold.ttf'):
+        self.size = size
+        self.font = font
+        # The loaded font for each font size
+        self.fonts = {}
+        # Maps the text, font size and color to the rendered image, in order from least to most recently used
+        self.images = collections.OrderedDict()
+
+    # Returns the font of the given size, loading it the first time it is needed
+    # @param size - The font size
+    def get_font(self, size):
+        font = self.fonts.get(size)
+        if font is None:
+            font = pygame.font.Font(self.font, size)
+            self.fonts[size] = font
+        return font
+
+    # Returns an image of the text, rendering it only if it is not already in the cache
+    # @param text - The text to render
+    # @param size - The font size
+    # @param color - The color of the text
+    def render(self, text, size, color=(255, 255, 255)):
+        key = (text, size, color)
+        image = self.images.get(key)
+        if image is not None:
+            self.images.move_to_end(key)
+            return image
+        image = self.get_font(size).render(text, True, color)
+        # Antialiased text is see-through around the letters, so it keeps its transparency when it is converted
+        if pygame.display.get_surface() is not None:
+            image = image.convert_alpha()
+        self.images[key] = image
+        if len(self.images) > self.size:
+            self.images.popitem(last=False)
+        return image
+
+    # Draws a number one digit at a time, so each digit only ever has to be rendered once
+    # @param surface - The image to draw the number on
+    # @param number - The number to draw
+    # @param position - The x and y coordinates of the left side of the number
+    # @param size - The font size
+    # @param color - The color of the number
+    # Returns the x coordinate just after the last digit
+    def blit_number(self, surface, number, position, size, color=(255, 255, 255)):
+        x, y = position
+        for digit in str(number):
+            image = self.render(digit, size, color)
+            surface.blit(image, (x, y))
+            x += image.get_width()
+        return x
+
+
+# The text cache shared by the overlay, the end screen and anything else that draws text
+text_cache = TextCache()
+
+
+# Class that loads the fonts, sound effects and music on a background thread, so the window can show the first frame
+# straight away. Decoded sounds are saved as WAV files in a cache folder, so later launches don't decode any MP3s
+class AssetLoader:
+    # The font sizes used by the overlay and the end screen
+    FONT_SIZES = (18, 40)
+
+    # Constructor for the AssetLoader class
+    # @param sounds - The SoundBank to load the sound effects into
+    # @param music - The file of the background music, or None for no music
+    # @param cache - The folder decoded sounds are kept in, or None to decode them on every launch
+    # @param audio - Whether to start the mixer and load the sounds and music
+    def __init__(self, sounds, music=None, cache=None, audio=True):
+        self.sounds = sounds
+        self.music = music
+        self.cache = cache
+        self.audio = audio
+        # Set once everything has been loaded, or has failed to load
+        self.ready = threading.Event()
+        # The file the music is played from, which is the cached WAV after the first launch
+        self.music_file = None
+        # Messages about the assets that could not be loaded. The game is played without them
+        self.errors = []
+        # How long loading took in seconds
+        self.duration = None
+        self.thread = None
+
+    # Starts loading the assets
+    # @param background - Whether to load on another thread instead of before returning
+    def start(self, background=True):
+        if background:
+            self.thread = threading.Thread(target=self.load, name='assets', daemon=True)
+            self.thread.start()
+        else:
+            self.load()
+
+    # Loads every asset and sets ready
+    def load(self):
+        start = time.perf_counter()
+        try:
+            for size in self.FONT_SIZES:
+                text_cache.get_font(size)
+            if self.audio:
+                self.load_audio()
+        finally:
+            self.duration = time.perf_counter() - start
+            self.ready.set()
+
+    # Starts the mixer and loads the sound effects and music
+    def load_audio(self):
+        try:
+            pygame.mixer.init()
+        except pygame.error as error:
+            self.errors.append('No audio: %s' % error)
+            return
+        try:
+            self.sounds.load(self.decode)
+        except (pygame.error, OSError) as error:
+            self.errors.append('Could not load the sound effects: %s' % error)
+        if self.music is None:
+            return
+        try:
+            # The music is played from its cached WAV, which is decoded once here, so no MP3 is decoded while playing
+            path = self.cached(self.music)
+            if path is None:
+                path = self.music
+            elif not os.path.exists(path):
+                self.save(path, pygame.mixer.Sound(self.music).get_raw())
+            pygame.mixer.music.load(path)
+            self.music_file = path
+        except (pygame.error, OSError) as error:
+            self.errors.append('Could not load the music: %s' % error)
+
+    # Returns the decoded sound in a file, reading it from the cache if it was decoded on an earlier launch
+    # @param path - The sound file
+    def decode(self, path):
+        cached = self.cached(path)
+        if cached is not None and os.path.exists(cached):
+            with wave.open(cached, 'rb') as f:
+                return pygame.mixer.Sound(buffer=f.readframes(f.getnframes()))
+        sound = pygame.mixer.Sound(path)
+        if cached is not None:
+            self.save(cached, sound.get_raw())
+        return sound
+
+    # Returns the file in the cache for a sound file, or None if sounds can't be cached
+    # @param path - The sound file
+    def cached(self, path):
+        if self.cache is None:
+            return None
+        frequency, size, channels = pygame.mixer.get_init()
+        # The cache holds the mixer's samples as they are, so they have to be in the little endian 16 bit format
+        # that WAV files use, which is the mixer's normal format
+        if size != -16 or sys.byteorder != 'little':
+            return None
+        stat = os.stat(path)
+        # The name changes if the sound file or the mixer's format changes, so an out of date file is never used
+        key = '%s %d %d %d %d' % (os.path.abspath(path), stat.st_size, stat.st_mtime_ns, frequency, channels)
+        name = os.path.splitext(os.path.basename(path))[0]
+        return os.path.join(self.cache, '%s-%08x.wav' % (name, zlib.crc32(key.encode())))
+
+    # Saves decoded samples to a WAV file in the cache
+    # @param path - The file in the cache
+    # @param samples - The samples in the mixer's format, from Sound.get_raw
+    def save(self, path, samples):
+        frequency, size, channels = pygame.mixer.get_init()
+        os.makedirs(self.cache, exist_ok=True)
+        # The file is written under another name first so a launch that is closed part way never leaves a broken file
+        temporary = path + '.tmp'
+        with wave.open(temporary, 'wb') as f:
+            f.setnchannels(channels)
+            f.setsampwidth(2)
+            f.setframerate(frequency)
+            f.writeframes(samples)
+        os.replace(temporary, path)
 
 
 # This is the class for the overlay that contains the score and lives information
@@ -10,46 +293,163 @@ class Overlay(pygame.sprite.Sprite):
     def __init__(self):
         super(pygame.sprite.Sprite, self).__init__()
         # Specifies the size of the text box and makes it a rectangle
-        self.image = pygame.Surface((500, 20))
+        self.image = pygame.Surface((500, 20)).convert()
+        # The black around the text is see-through, so the stars show behind it
+        self.image.set_colorkey((0, 0, 0))
         self.rect = self.image.get_rect()
-        # Sets the font style and size
-        self.font = pygame.font.Font('freesansbold.ttf', 18)
-        # These are the starting values for lives and score
-        self.render('Score: 0        Lives: 3')
+        # Sets the font size
+        self.size = 18
+        # The text is rendered on the first update, once the fonts have been loaded
+        self.image.fill((0, 0, 0))
+        self.score = None
+        self.lives = None
+        self.changed = True
 
-    # Sets the text of the overlay based on score and lives passed in
-    def render(self, text):
-        # Makes text white
-        self.text = self.font.render(text, True, (255, 255, 255))
-        # Writes the text to the overlay
-        self.image.blit(self.text, self.rect)
+    # Sets the text of the overlay based on score and lives passed in. The labels and each digit come from the text
+    # cache, so only text that has never been seen before is rendered
+    def render(self, score, lives):
+        # Clears the old text
+        self.image.fill((0, 0, 0))
+        # Writes the text to the overlay in white
+        x = self.image.blit(text_cache.render('Score: ', self.size), (0, 0)).right
+        x = text_cache.blit_number(self.image, score, (x, 0), self.size)
+        x = self.image.blit(text_cache.render('        Lives: ', self.size), (x, 0)).right
+        text_cache.blit_number(self.image, lives, (x, 0), self.size)
+        self.changed = True
 
     # Draws the overlay to the screen
-    def draw(self, screen):
+    # @param renderer - The game's Renderer. The overlay only needs drawing again when it changes or is drawn over
+    def draw(self, renderer):
         # Draws the overlay at the top right of the screen
-        screen.blit(self.text, (0, 0))
+        renderer.blit_static(self.image, self.rect, self.changed)
+        self.changed = False
 
     # Sets the texted based on the score and lives of the game
     def update(self, score, lives):
-        self.render('Score: ' + str(score) + '        Lives: ' + str(lives))
+        # The text only needs drawing again if the score or lives changed
+        if score != self.score or lives != self.lives:
+            self.score = score
+            self.lives = lives
+            self.render(score, lives)
+
+
+# Class that draws to the screen and puts each finished frame on the display. It can either clear and flip the
+# whole screen every frame, or only erase and update the areas that were drawn on, which is much cheaper when most
+# of the screen is black
+class Renderer:
+    # Constructor for the Renderer class
+    # @param screen - The display surface to draw on
+    # @param dirty - Only updates the parts of the display that changed instead of flipping the whole screen
+    def __init__(self, screen, dirty=False):
+        self.screen = screen
+        self.dirty = dirty
+        self.background = (0, 0, 0)
+        self.fblits = getattr(screen, 'fblits', None)
+        # The areas drawn on this frame and the areas drawn last frame, which were erased
+        self.drawn = []
+        self.erased = []
+        # The areas of images drawn with blit_static this frame. They are not erased on the next frame
+        self.updated = []
+        # Areas to clear at the start of the next frame even though nothing was drawn there with blit
+        self.invalid = []
+        # The whole screen has to be cleared and put on the display the first time
+        self.full = True
+
+    # Gets the screen ready to draw a new frame
+    def begin(self):
+        if not self.dirty or self.full:
+            # Clears the screen of all objects so they can be accurately redrawn
+            self.screen.fill(self.background)
+            self.drawn = []
+            self.invalid = []
+            return
+        # Only the areas that were drawn on last frame, or that were invalidated, need to be cleared
+        fill = self.screen.fill
+        self.erased = self.drawn + self.invalid
+        for rect in self.erased:
+            fill(self.background, rect)
+        self.drawn = []
+        self.invalid = []
+
+    # Clears an area at the start of the next frame, such as the area under a see-through image drawn with
+    # blit_static that is about to change, so its old picture doesn't show through the new one
+    # @param rect - The area to clear
+    def invalidate(self, rect):
+        if self.dirty:
+            self.invalid.append(rect)
+
+    # Draws an image to the screen, in the same way as Surface.blit
+    # @param image - The image to draw
+    # @param position - Where to draw the image
+    def blit(self, image, position):
+        rect = self.screen.blit(image, position)
+        if self.dirty:
+            self.drawn.append(rect)
+        return rect
+
+    # Draws a list of images to the screen, in the same way as Surface.blits. This lets sprite groups draw to it
+    # @param sequence - Pairs of the images and their positions
+    # @param doreturn - Whether to return the areas that were drawn on
+    def blits(self, sequence, doreturn=True):
+        # Surface.fblits is faster still, but only some versions of pygame have it and it can't return the areas
+        if not self.dirty and not doreturn and self.fblits is not None:
+            self.fblits(sequence)
+            return None
+        rects = self.screen.blits(sequence, self.dirty or doreturn)
+        if self.dirty:
+            self.drawn.extend(rects)
+        return rects
+
+    # Records areas that were drawn on without blitting, like pixels written straight to the screen, so that in dirty
+    # mode they are put on the display and erased on the next frame
+    # @param rects - The areas that were drawn on
+    def mark(self, rects):
+        if self.dirty:
+            self.drawn.extend(rects)
+
+    # Draws an image that stays on the screen between frames, like the overlay. In dirty mode it is only drawn again
+    # if it changed or if something was drawn or erased underneath it, so it should be drawn last. If the image is
+    # see-through, its area has to be invalidated before the frame begins whenever it changes
+    # @param image - The image to draw
+    # @param rect - Where to draw the image
+    # @param changed - Whether the image changed since the last frame
+    def blit_static(self, image, rect, changed):
+        if not self.dirty:
+            return self.screen.blit(image, rect)
+        if changed or self.full or rect.collidelist(self.drawn) != -1 or rect.collidelist(self.erased) != -1:
+            self.updated.append(self.screen.blit(image, rect))
+        return rect
+
+    # Puts the frame on the display
+    def present(self):
+        if not self.dirty or self.full:
+            pygame.display.flip()
+            self.full = False
+        else:
+            pygame.display.update(self.erased + self.drawn + self.updated)
+        self.erased = []
+        self.updated = []
+
 
 # Class for the player's ship
 class Ship(pygame.sprite.Sprite):
     # Constructor for the Ship class
     def __init__(self):
         pygame.sprite.Sprite.__init__(self)
-        # The ship will take up a 20 by 2 pixel area
-        self.image = pygame.Surface((20, 20))
-        # Sets the color of the ship to a dark green
-        self.image.fill((20, 100, 0))
+        # The ship will take up a 20 by 2 pixel area and its color is set to a dark green
+        self.image = surface_cache.get((20, 20), (20, 100, 0))
         # Sets the starting location of the ship
         self.rect = self.image.get_rect()
         self.rect.x = 300
         self.rect.y = 650
+        # Where the ship was before it last moved
+        self.previous_x = self.rect.x
 
     # Draws the ship onto the screen
-    def draw(self, screen):
-        screen.blit(self.image, self.rect)
+    # @param screen - The screen or Renderer to draw the ship on
+    # @param back - How far back towards its last position to draw the ship, from 0 to 1
+    def draw(self, screen, back=0.0):
+        screen.blit(self.image, (self.rect.x - round((self.rect.x - self.previous_x) * back), self.rect.y))
 
 
 # Class for the enemy ships
@@ -59,171 +459,429 @@ class Enemy(pygame.sprite.Sprite):
     # @param position - The starting position for the ship
     def __init__(self, color, position):
         pygame.sprite.Sprite.__init__(self)
-        # The enemy will take up a 20 by 20 area
-        self.image = pygame.Surface((20, 20))
-        # Sets the color to be the colors passed in
-        self.image.fill((color[0], color[1], color[2]))
+        # The enemy will take up a 20 by 20 area and its color is set to be the colors passed in.
+        # Enemies of the same color share the same image
+        self.image = surface_cache.get((20, 20), (color[0], color[1], color[2]))
         # Sets the position to be what was passed in
         self.rect = self.image.get_rect()
         self.rect.x = position[0]
         self.rect.y = position[1]
-        # The ship starts moving right
-        self.direction = 1
-
-    # Function to determine if the ships need to change direction
-    # @param enemies - The group of enemy sprites being used by the game
-    def changeDirection(self, enemies):
-        # Runs through all the enemeies and checks if each one is on the edge of the screen
-        for e in enemies:
-            if e.rect.x <= 0 or e.rect.x >= 580:
-                # If a ship is on the edge of the screen, the function returns -1,
-                # indicating that the ships need to change direction
-                return -1
-        # If none of the ships are on the edge of the screen, it returns 1, keeping the ships moving the same direction
-        return 1
-
-    # The function to move the enemies and draw them to the screen
-    # @param screen - The screen to which we need to draw the enemy
-    def update(self, screen):
-        # Moves the enemy in the correct direction
-        self.rect.x += self.direction
-        # Draws the enemy to the screen
-        screen.blit(self.image, self.rect)
-
-    # Function to determine if the enemy will shoot and to produce a projectile if it does
+        # The formation the enemy flies in, which decides the direction it moves, and its place in the formation
+        self.formation = None
+        self.order = 0
+
+    # Removes the enemy from the game and from its formation
+    def kill(self):
+        if self.formation is not None:
+            self.formation.remove(self)
+        pygame.sprite.Sprite.kill(self)
+
+    # Function to produce a projectile from the enemy. The FireScheduler decides when each enemy shoots
     # @param game - all the game data we need to access
     def shoot(self, game):
-        # Randomly generated a number in a ranged based on the number of enemies remaining.
-        # Therefore, each ship will have a greater chance of firing a projectile the fewer enemies there are remaining.
-        # The multiplier of 20 is essentially a difficulty multiplier. It can be lowered to increase the chance that the
-        # ship will fire a projectile and thus increase the difficulty.
-        shotchance = random.randint(0, len(game.enemies)*20)
-        if shotchance == 1:
-            # Creates a non-friendly projectile in the middle of the ship, at a random downward angle.
-            # It always has a vertical velocity of 3.
-            projectile = Projectile([self.rect.x + 10, self.rect.y], [random.randint(-2, 2), 3], False)
-            # Adds the projectile to the projectiles group of the game
-            game.projectiles.add(projectile)
-
-
-# Class for all the projectiles in the game
-class Projectile(pygame.sprite.Sprite):
-    # Constructor for the Projectile class
+        # Creates a non-friendly projectile in the middle of the ship, at a random downward angle.
+        # It always has a vertical velocity of 3, unless the game's balance is changed.
+        balance = game.balance
+        game.fire([self.rect.x + 10, self.rect.y],
+                  [game.random.randint(-balance.enemy_spread, balance.enemy_spread), balance.enemy_speed], False)
+
+
+# Class that holds the numbers that decide how hard the game is. They can be changed to tune the game
+class Balance:
+    # The names of all the settings, in the order they are stored in replay files
+    NAMES = ('shot_multiplier', 'max_friendly_shots', 'friendly_speed', 'enemy_speed', 'enemy_spread', 'ship_speed',
+             'columns', 'rows', 'lives', 'formations')
+
+    # Constructor for the Balance class
+    # @param shot_multiplier - The enemies' fire multiplier. It can be lowered to make the enemies fire more often
+    # @param max_friendly_shots - The player can fire while this many or fewer of their projectiles are on the screen
+    # @param friendly_speed - How many pixels the player's projectiles move up each frame
+    # @param enemy_speed - How many pixels the enemies' projectiles move down each frame
+    # @param enemy_spread - The largest sideways speed of the enemies' projectiles
+    # @param ship_speed - How many pixels the ship moves each time an arrow key is pressed
+    # @param columns - The number of enemies in each row of the wave
+    # @param rows - The number of rows of enemies in the wave
+    # @param lives - The number of lives the player starts with
+    # @param formations - The number of formations the rows of the wave are split into
+    def __init__(self, shot_multiplier=20, max_friendly_shots=6, friendly_speed=4, enemy_speed=3, enemy_spread=2,
+                 ship_speed=5, columns=10, rows=6, lives=3, formations=1):
+        self.shot_multiplier = shot_multiplier
+        self.max_friendly_shots = max_friendly_shots
+        self.friendly_speed = friendly_speed
+        self.enemy_speed = enemy_speed
+        self.enemy_spread = enemy_spread
+        self.ship_speed = ship_speed
+        self.columns = columns
+        self.rows = rows
+        self.lives = lives
+        self.formations = formations
+
+    # Returns the settings as a dictionary
+    def as_dict(self):
+        return dict((name, getattr(self, name)) for name in self.NAMES)
+
+    def __repr__(self):
+        return 'Balance(%s)' % ', '.join('%s=%r' % item for item in self.as_dict().items())
+
+
+# Class that decides when each enemy shoots. Every frame, each enemy has a 1 in (number of enemies * 20 + 1) chance
+# of firing a projectile. Therefore, each ship will have a greater chance of firing a projectile the fewer enemies
+# there are remaining. Rather than rolling that chance for every enemy on every frame, the scheduler works out how many
+# frames it will be until each enemy's next shot, which follows the same odds, and keeps them in a queue
+class FireScheduler:
+    # Constructor for the FireScheduler class
+    # @param multiplier - The multiplier of 20 is essentially a difficulty multiplier. It can be lowered to increase
+    #                     the chance that the ship will fire a projectile and thus increase the difficulty
+    def __init__(self, multiplier=20):
+        self.multiplier = multiplier
+        # Queue of the frame each enemy will next shoot on, the enemy's place in the group and the enemy
+        self.queue = []
+        # The number of enemies the queue was worked out for
+        self.count = None
+
+    # Returns the number of frames until the next shot, counting this frame as 1
+    # @param rng - The random number generator of the game
+    # @param chance - The chance of shooting on any one frame
+    def frames_until_shot(self, rng, chance):
+        if chance >= 1:
+            return 1
+        return int(math.log(1.0 - rng.random()) / math.log(1.0 - chance)) + 1
+
+    # Works out the next shot of every enemy again. The chance of shooting doesn't depend on how long an enemy has
+    # waited, so this can be done whenever the number of enemies changes
+    # @param game - all the game data we need to access
+    def schedule(self, game):
+        self.count = len(game.enemies)
+        chance = 1 / (self.count * self.multiplier + 1)
+        self.queue = [(game.frame + self.frames_until_shot(game.random, chance) - 1, order, e)
+                      for order, e in enumerate(game.enemies)]
+        heapq.heapify(self.queue)
+
+    # Makes every enemy whose shot is due on this frame shoot, in the order they are in the group
+    # @param game - all the game data we need to access
+    def update(self, game):
+        if len(game.enemies) != self.count:
+            self.schedule(game)
+        chance = 1 / (self.count * self.multiplier + 1)
+        queue = self.queue
+        while queue and queue[0][0] <= game.frame:
+            frame, order, e = heapq.heappop(queue)
+            # Enemies destroyed since the queue was worked out are dropped from it
+            if not e.alive():
+                continue
+            e.shoot(game)
+            heapq.heappush(queue, (game.frame + self.frames_until_shot(game.random, chance), order, e))
+
+
+# Class for a group of enemies that move side to side together. The formation keeps track of the left and right
+# edges of its enemies as they move and are destroyed, so it never has to look through all of them to turn around
+class Formation:
+    # Constructor for the Formation class
+    # @param left - The formation turns around when an enemy reaches this x coordinate
+    # @param right - The formation turns around when an enemy reaches this x coordinate
+    # @param direction - 1 if the formation starts moving right, -1 if it starts moving left
+    def __init__(self, left=0, right=580, direction=1):
+        self.left = left
+        self.right = right
+        # The group of enemies in the formation
+        self.enemies = pygame.sprite.Group()
+        self.direction = direction
+        # How far the formation has moved since it was created, and how far it moved on the last frame
+        self.shift = 0
+        self.moved = 0
+        # The number of enemies at each x coordinate the formation started with. Enemies only move with the formation,
+        # so the enemies in a column stay together
+        self.columns = {}
+        # The smallest and largest x coordinate of any enemy when the formation was created
+        self.min_x = None
+        self.max_x = None
+        # Grid of the enemies where they would be if the formation had not moved. The enemies never move apart, so it
+        # only changes when an enemy is added or removed
+        self.grid = SpatialHash()
+
+    # The number of enemies left in the formation
+    def __len__(self):
+        return len(self.enemies)
+
+    # Adds an enemy to the formation
+    # @param enemy - The enemy to add
+    # @param order - The enemy's position in the game's enemies group, which decides which enemy is hit first. It has
+    #                to come from the group rather than the formation, so enemies in different formations never tie
+    def add(self, enemy, order):
+        enemy.formation = self
+        self.enemies.add(enemy)
+        enemy.order = order
+        self.grid.add(enemy, enemy.order, enemy.rect.move(-self.shift, 0))
+        # Stores the column as if the formation had not moved yet
+        column = enemy.rect.x - self.shift
+        self.columns[column] = self.columns.get(column, 0) + 1
+        if self.min_x is None or column < self.min_x:
+            self.min_x = column
+        if self.max_x is None or column > self.max_x:
+            self.max_x = column
+
+    # Removes an enemy from the formation. This is called when the enemy is killed
+    # @param enemy - The enemy to remove
+    def remove(self, enemy):
+        if enemy not in self.enemies:
+            return
+        self.enemies.remove(enemy)
+        self.grid.remove(enemy)
+        enemy.formation = None
+        column = enemy.rect.x - self.shift
+        self.columns[column] -= 1
+        if self.columns[column] > 0:
+            return
+        del self.columns[column]
+        # The edges only need to be found again if the last enemy in an edge column was removed
+        if column == self.min_x or column == self.max_x:
+            if self.columns:
+                self.min_x = min(self.columns)
+                self.max_x = max(self.columns)
+            else:
+                self.min_x = None
+                self.max_x = None
+
+    # Puts every enemy in the formation back into the grid, after they were moved without the formation
+    def rebuild(self):
+        self.grid.clear()
+        for e in self.enemies:
+            self.grid.add(e, e.order, e.rect.move(-self.shift, 0))
+
+    # Returns the enemy that collides with a rectangle and its order, or None if none do
+    # @param rect - The rectangle to check, on the screen
+    def search(self, rect):
+        return self.grid.search(rect.move(-self.shift, 0))
+
+    # Turns the formation around if one of its enemies is on the edge of the screen, then moves every enemy
+    def update(self):
+        if self.min_x is None:
+            self.moved = 0
+            return
+        # If a ship is on the edge of the screen, the ships need to change direction
+        if self.min_x + self.shift <= self.left or self.max_x + self.shift >= self.right:
+            self.direction = -self.direction
+        self.shift += self.direction
+        self.moved = self.direction
+        # Moves the enemies in the correct direction
+        for e in self.enemies:
+            e.rect.x += self.direction
+
+
+# Class that shares a single image between everything of the same size and color. Once the display has been
+# created the images are converted to its pixel format, so drawing them doesn't have to convert every pixel
+class SurfaceCache:
+    # Constructor for the SurfaceCache class
+    def __init__(self):
+        # Maps the size and color of each image to the image
+        self.surfaces = {}
+
+    # Returns an image of a solid color, creating it the first time it is needed
+    # @param size - The width and height of the image
+    # @param color - The RGB values for the image's color
+    def get(self, size, color):
+        key = (size, color)
+        surface = self.surfaces.get(key)
+        if surface is None:
+            surface = pygame.Surface(size)
+            surface.fill(color)
+            if pygame.display.get_surface() is not None:
+                surface = surface.convert()
+            self.surfaces[key] = surface
+        return surface
+
+    # Converts every image to the pixel format of the display. This is called whenever the display is created,
+    # since images made before then could not be converted
+    def convert(self):
+        for key, surface in self.surfaces.items():
+            self.surfaces[key] = surface.convert()
+
+
+# The image cache shared by everything in the game
+surface_cache = SurfaceCache()
+
+
+# Class that keeps a number of objects around so they can be used again instead of being created and thrown away.
+# The objects in use can be looped over and drawn just like a sprite group
+class Pool:
+    # Constructor for the Pool class
+    # @param factory - Function that creates a new object for the pool
+    # @param size - The number of objects to create up front. More are created if the pool runs out
+    def __init__(self, factory, size):
+        self.factory = factory
+        # The objects that are not being used
+        self.free = [factory() for i in range(0, size)]
+        # The objects in use, in the order they were taken from the pool
+        self.active = {}
+        # The number of objects the pool has created, and the most that have been in use at the same time
+        self.created = size
+        self.high_water = 0
+
+    # The number of objects in use
+    def __len__(self):
+        return len(self.active)
+
+    # Loops over a copy of the objects in use, so they can be released while looping
+    def __iter__(self):
+        return iter(list(self.active))
+
+    def __contains__(self, obj):
+        return obj in self.active
+
+    # Takes an object from the pool, creating a new one if every object is in use
+    def acquire(self):
+        if self.free:
+            obj = self.free.pop()
+        else:
+            obj = self.factory()
+            self.created += 1
+        self.active[obj] = None
+        if len(self.active) > self.high_water:
+            self.high_water = len(self.active)
+        return obj
+
+    # Puts an object back into the pool once it is no longer needed
+    # @param obj - The object to put back
+    def release(self, obj):
+        if obj in self.active:
+            del self.active[obj]
+            self.free.append(obj)
+
+    # Puts every object back into the pool
+    def empty(self):
+        for obj in self.active:
+            self.free.append(obj)
+        self.active = {}
+
+    # Returns how many objects are in use, how many are free, the most that have been in use at once and how many
+    # have been created, which can be used to choose the size of the pool
+    def stats(self):
+        return {'active': len(self.active), 'free': len(self.free), 'high_water': self.high_water,
+                'created': self.created}
+
+    # Draws every object in use to the screen
+    # @param screen - The screen or Renderer to draw on
+    # @param back - How far back towards its last position to draw each object, from 0 to 1
+    def draw(self, screen, back=0.0):
+        if back:
+            screen.blits([(obj.image, obj.position(back)) for obj in self.active], False)
+        else:
+            screen.blits([(obj.image, obj.rect) for obj in self.active], False)
+
+
+# Class for all the projectiles in the game. Projectiles are kept in a Pool and reused once they are removed
+class Projectile:
+    __slots__ = ('friendly', 'image', 'rect', 'vector')
+
+    # Constructor for the Projectile class. The projectile is not in play until it is fired with reset
+    def __init__(self):
+        self.friendly = False
+        self.image = None
+        # Each projectile takes up a space of 4 by 10 pixels
+        self.rect = pygame.Rect(0, 0, 4, 10)
+        self.vector = None
+
+    # Fires the projectile
     # @param position - a tuple containing the starting coordinates for the projectile
     # @param vector - a tuple containing the x and y velocities of the projectile
     # @param friendly - a bool determining whether the projectile was fired by the player or by an enemy
-    def __init__(self, position, vector, friendly):
-        pygame.sprite.Sprite.__init__(self)
+    # @param sounds - The game's SoundBank
+    def reset(self, position, vector, friendly, sounds):
         self.friendly = friendly
-        # Each projectile takes up a space of 4 by 10 pixels
-        self.image = pygame.Surface((4, 10))
         if self.friendly:
             # if the projectile was fired by the player, the color of the projectile is set to white
-            self.image.fill((255, 255, 255))
-            # Sets the sound of the projectile firing to the appropriate soundbyte
-            self.fire_sound = pygame.mixer.Sound('assets/friendly_fire.mp3')
-            # Sets the appropriate volume for the sound
-            self.fire_sound.set_volume(.6)
+            self.image = surface_cache.get((4, 10), (255, 255, 255))
         else:
             # If the projectile was fired by an enemy, the color is red
-            self.image.fill((255, 0, 0))
-            # Sets the sound of the projectile firing to the appropriate soundbyte
-            self.fire_sound = pygame.mixer.Sound('assets/enemy_fire.mp3')
-            # Sets the appropriate volume for the sound. The volume is low because there are lots of enemy projectiles
-            # fired per second
-            self.fire_sound.set_volume(.15)
-        # Sets the sound to be played when the projectile hits a ship
-        self.hit_sound = pygame.mixer.Sound('assets/explosion.mp3')
-        # Sets the appropriate volume for the sound
-        self.hit_sound.set_volume(.3)
-        self.rect = self.image.get_rect()
+            self.image = surface_cache.get((4, 10), (255, 0, 0))
         # Sets the starting x and y coordinates of the projectile
         self.rect.x = position[0]
         self.rect.y = position[1]
         # Sets the x and y velocities of the projectile
         self.vector = vector
         # Plays the appropriate sound effect based on whether the projectile is friendly or from an enemy
-        self.fire_sound.play()
+        sounds.play('friendly_fire' if self.friendly else 'enemy_fire')
+        return self
 
-    # Updates the position of the projectile
+    # Updates the position of the projectile. Collisions are handled for all the projectiles at once by Game.collide
     # @param game - all the game data we need to access
     def update(self, game):
-        # If the projectile hits the edge of the screen, it is removed from the game's projectiles group
+        # If the projectile hits the edge of the screen, it is put back into the game's projectile pool
         if self.rect.x < 0 or self.rect.x > 600 or self.rect.y < 0 or self.rect.y > 800:
-            game.projectiles.remove(self)
-        # Detects whether the projectile hit an enemy ship
-        hitObject = pygame.sprite.spritecollideany(self, game.enemies)
-        if hitObject:
-            # Only considers the collision if the projectile was fired by the player. Therefore, enemy projectiles
-            # will go through other enemies.
-            if self.friendly:
-                # Removes the hit enemy from the game and the enemies group
-                hitObject.kill()
-                # Removes the projectile from the game's projectile group
-                game.projectiles.remove(self)
-                # Adds 1 to the player's score
-                game.score += 1
-                # Plays the collision sound effect
-                self.hit_sound.play()
-        # Detects if a projectile hit the player ship
-        if pygame.sprite.collide_rect(self, game.ship):
-            # Only considers the collision if the projectile was fired from an enemy.
-            if not self.friendly:
-                # Removes the projectile from the game's projectile group
-                game.projectiles.remove(self)
-                # Triggers a new life event, which is handled in the game class.
-                pygame.event.post(game.new_life_event)
-                # Plays the collision sound effect
-                self.hit_sound.play()
+            game.projectiles.release(self)
         # If the projectile is not at the edge of the screen or hit an opposing ship, it continues moving in the
         # direction it was heading
         self.rect.x += self.vector[0]
         self.rect.y += self.vector[1]
 
+    # Returns where to draw the projectile between its last position and where it is now
+    # @param back - How far back towards its last position to draw it, from 0 to 1
+    def position(self, back):
+        return self.rect.x - round(self.vector[0] * back), self.rect.y - round(self.vector[1] * back)
+
 
-# The class for the stars moving in the background of the game
-class Star(pygame.sprite.Sprite):
+# The class for the stars moving in the background of the game. Stars are kept in a Pool and reused once they
+# move off the screen
+class Star:
+    __slots__ = ('size', 'color', 'image', 'image_filled', 'rect')
+
+    # Constructor for the Star class. The star is not shown until it is placed with reset
     def __init__(self):
-        # Constructor for the Star class
-        pygame.sprite.Sprite.__init__(self)
+        self.size = 0
+        self.color = None
+        self.image = None
+        self.image_filled = True
+        self.rect = pygame.Rect(0, 0, 0, 0)
+
+    # Places the star at the top of the screen with a new size and color
+    # @param rng - The random number generator of the game
+    def reset(self, rng):
         # Randomly sets the diameter of the star between 3 and 5
-        self.size = random.randint(3, 5)
-        self.image = pygame.Surface((self.size, self.size))
-        # Generates a color based on 3 random numbers between 0 and 80, subtly changing the color of the star
-        self.color = (255-random.randint(0, 80), 255-random.randint(0, 80), 255-random.randint(0, 80))
-        self.image.fill(self.color)
+        self.size = rng.randint(3, 5)
+        # Generates a color based on 3 random numbers between 0 and 80, subtly changing the color of the star.
+        # The color is rounded to steps of 16 so stars of the same size and color can share an image
+        self.color = tuple(255 - rng.randint(0, 80) // 16 * 16 for i in range(0, 3))
+        self.image = surface_cache.get((self.size, self.size), self.color)
         # This variable denotes if the star is currecntly being shown on screen, and is used to make the star twinkle
         self.image_filled = True
-        self.rect = self.image.get_rect()
         # Generates a location for the star to start at. Always at the top of the screen but at a randomly location
         # on the x axis
-        self.rect.x = random.randint(0, 596)
+        self.rect.size = (self.size, self.size)
+        self.rect.x = rng.randint(0, 596)
         self.rect.y = 0
+        return self
 
     # Updates the location and state of the star
-    # @param stars - The list of all stars in the game
-    def update(self, stars):
+    # @param stars - The pool of all stars in the game
+    # @param rng - The random number generator of the game
+    def update(self, stars, rng):
         # Determines if the star will toggle between being visible and invisible based on a random number from 0 to 120
         # each clock cycle. So each star will twinkle on average every 2 seconds
-        if random.randint(0, 120) == 1:
+        if rng.randint(0, 120) == 1:
             if self.image_filled:
-                # If the star is currently visible, its color is set to black and the image_filled flag is toggled
-                self.image.fill((0, 0, 0))
+                # If the star is currently visible, its image is swapped for a black one and the image_filled flag
+                # is toggled
+                self.image = surface_cache.get((self.size, self.size), (0, 0, 0))
                 self.image_filled = False
             else:
-                # If the star is currently not visible, its color is set to its original color
+                # If the star is currently not visible, its image is set back to its original color
                 # and the image_filled flag is toggled
-                self.image.fill(self.color)
+                self.image = surface_cache.get((self.size, self.size), self.color)
                 self.image_filled = True
-        # If the star moves off the bottom of the screen, it is removed from the game's stars group
+        # If the star moves off the bottom of the screen, it is put back into the game's star pool
         if self.rect.y > 700:
-            stars.remove(self)
+            stars.release(self)
         # If the star is still on the screen, it moves at an interval determined by its size on the screen.
         # This gives the appearance of stars closer to the scene being bigger and moving faster, giving
         # a sense of depth
         else:
             self.rect.y += int(self.size/2)
 
+    # Returns where to draw the star between its last position and where it is now
+    # @param back - How far back towards its last position to draw it, from 0 to 1
+    def position(self, back):
+        return self.rect.x, self.rect.y - round(int(self.size/2) * back)
+
 
 # This is the class for the game over screen
 class EndScreen(pygame.sprite.Sprite):
@@ -238,8 +896,8 @@ class EndScreen(pygame.sprite.Sprite):
         self.rect = self.image.get_rect()
         self.rect.x = 0
         self.rect.y = 0
-        # sets font style and size of the end screen text
-        self.font = pygame.font.Font('freesansbold.ttf', 40)
+        # sets the font size of the end screen text
+        self.size = 40
         # Displays an appropriate message based on whether the player won or lost, and displays the ending score
         if win:
             self.render('You Win! Final Score: ' + str(score))
@@ -250,7 +908,7 @@ class EndScreen(pygame.sprite.Sprite):
     # @param text - The appropriate text to be written
     def render(self, text):
         # Sets the text to be white
-        self.text = self.font.render(text, True, (255, 255, 255))
+        self.text = text_cache.render(text, self.size)
         # Writes the text to the rectangle
         self.image.blit(self.text, self.rect)
 
@@ -261,33 +919,890 @@ class EndScreen(pygame.sprite.Sprite):
         screen.blit(self.text, (30, 300))
 
 
+# Class that keeps every projectile in NumPy arrays so they can be moved and checked for collisions all at once.
+# Projectiles are kept in the order they were fired, just like in a sprite group
+class ProjectileStore:
+    # Constructor for the ProjectileStore class
+    # @param sounds - The game's SoundBank, used to play the firing sounds
+    # @param capacity - The number of projectiles the arrays start with room for. They grow when they fill up
+    def __init__(self, sounds, capacity=256):
+        if numpy is None:
+            raise ImportError('The array-backed projectile store needs NumPy')
+        self.sounds = sounds
+        # The number of slots in use. Slots past this are unused
+        self.count = 0
+        # Positions, velocities and sizes of the projectiles
+        self.x = numpy.zeros(capacity, numpy.int32)
+        self.y = numpy.zeros(capacity, numpy.int32)
+        self.vx = numpy.zeros(capacity, numpy.int32)
+        self.vy = numpy.zeros(capacity, numpy.int32)
+        self.w = numpy.zeros(capacity, numpy.int32)
+        self.h = numpy.zeros(capacity, numpy.int32)
+        # True if the projectile was fired by the player
+        self.friendly = numpy.zeros(capacity, bool)
+        # False once the projectile has left the screen or hit a ship. Dead slots are removed by compact
+        self.alive = numpy.zeros(capacity, bool)
+        # Projectiles are only turned into images when they are drawn. Each side shares a single image
+        self.images = {}
+        self.images[True] = surface_cache.get((4, 10), (255, 255, 255))
+        self.images[False] = surface_cache.get((4, 10), (255, 0, 0))
+
+    # The number of projectiles in play
+    def __len__(self):
+        return int(numpy.count_nonzero(self.alive[:self.count]))
+
+    # Returns the number of projectiles fired by the player that are still in play
+    def friendly_count(self):
+        n = self.count
+        return int(numpy.count_nonzero(self.alive[:n] & self.friendly[:n]))
+
+    # Adds a projectile, in the same way as creating a Projectile
+    # @param position - a tuple containing the starting coordinates for the projectile
+    # @param vector - a tuple containing the x and y velocities of the projectile
+    # @param friendly - a bool determining whether the projectile was fired by the player or by an enemy
+    def spawn(self, position, vector, friendly):
+        if self.count == len(self.x):
+            # Doubles the size of every array when they are full
+            for name in ('x', 'y', 'vx', 'vy', 'w', 'h', 'friendly', 'alive'):
+                array = getattr(self, name)
+                setattr(self, name, numpy.concatenate((array, numpy.zeros_like(array))))
+        i = self.count
+        self.x[i] = position[0]
+        self.y[i] = position[1]
+        self.vx[i] = vector[0]
+        self.vy[i] = vector[1]
+        # Each projectile takes up a space of 4 by 10 pixels
+        self.w[i] = 4
+        self.h[i] = 10
+        self.friendly[i] = friendly
+        self.alive[i] = True
+        self.count += 1
+        # Plays the appropriate sound effect based on whether the projectile is friendly or from an enemy
+        self.sounds.play('friendly_fire' if friendly else 'enemy_fire')
+
+    # Finds and handles every projectile that hit a ship this frame, in the same way as Game.collide
+    # @param game - all the game data we need to access
+    def collide(self, game):
+        n = self.count
+        x, y, w, h = self.x[:n], self.y[:n], self.w[:n], self.h[:n]
+        # Enemy projectiles that overlap the player ship
+        ship = game.ship.rect
+        hits = self.alive[:n] & ~self.friendly[:n]
+        hits &= (x < ship.right) & (x + w > ship.left) & (y < ship.bottom) & (y + h > ship.top)
+        for i in numpy.flatnonzero(hits):
+            self.alive[i] = False
+            # Takes a life from the player. The game ends once there are none left
+            game.lives -= 1
+            game.sounds.play('explosion')
+        enemies = game.enemies.sprites()
+        shots = numpy.flatnonzero(self.alive[:n] & self.friendly[:n])
+        if not enemies or len(shots) == 0:
+            return
+        # The rectangles of all the enemies, in the order they are in the group
+        rects = numpy.array([e.rect for e in enemies], numpy.int32)
+        ex, ey, ew, eh = rects[:, 0], rects[:, 1], rects[:, 2], rects[:, 3]
+        # Table of which of the player's projectiles (rows) overlap which enemies (columns)
+        overlap = (x[shots, None] < ex + ew) & (x[shots, None] + w[shots, None] > ex)
+        overlap &= (y[shots, None] < ey + eh) & (y[shots, None] + h[shots, None] > ey)
+        # Only the projectiles that hit something are looked at one by one, so the first enemy in the group
+        # that has not already been destroyed this frame is the one that is hit
+        killed = set()
+        for row in numpy.flatnonzero(overlap.any(axis=1)):
+            for column in numpy.flatnonzero(overlap[row]):
+                if column not in killed:
+                    killed.add(column)
+                    enemies[column].kill()
+                    self.alive[shots[row]] = False
+                    # Adds 1 to the player's score
+                    game.score += 1
+                    game.sounds.play('explosion')
+                    break
+
+    # Removes the projectiles at the edge of the screen and moves the rest, in the same way as Projectile.update
+    def update(self):
+        n = self.count
+        x, y = self.x[:n], self.y[:n]
+        self.alive[:n] &= ~((x < 0) | (x > 600) | (y < 0) | (y > 800))
+        x += self.vx[:n]
+        y += self.vy[:n]
+        self.compact()
+
+    # Moves the projectiles that are still in play to the front of the arrays, keeping them in order
+    def compact(self):
+        n = self.count
+        keep = numpy.flatnonzero(self.alive[:n])
+        if len(keep) == n:
+            return
+        for name in ('x', 'y', 'vx', 'vy', 'w', 'h', 'friendly', 'alive'):
+            array = getattr(self, name)
+            array[:len(keep)] = array[keep]
+        self.count = len(keep)
+
+    # Draws every projectile to the screen
+    # @param screen - The screen or Renderer to draw the projectiles on
+    # @param back - How far back towards its last position to draw each projectile, from 0 to 1
+    def draw(self, screen, back=0.0):
+        n = self.count
+        x, y = self.x[:n], self.y[:n]
+        if back:
+            x = x - numpy.rint(self.vx[:n] * back).astype(x.dtype)
+            y = y - numpy.rint(self.vy[:n] * back).astype(y.dtype)
+        images = self.images
+        screen.blits([(images[f], (x, y)) for x, y, f in zip(x.tolist(), y.tolist(),
+                                                                self.friendly[:n].tolist())], False)
+
+    # Removes every projectile
+    def empty(self):
+        self.count = 0
+
+
+# Class that keeps every background star in NumPy arrays, so the whole star field is moved, twinkled and drawn at once
+# instead of one sprite at a time. It has its own random number generator, so the stars never change the game
+class StarField:
+    # Constructor for the StarField class
+    # @param seed - The seed of the star field's random number generator
+    # @param capacity - The number of stars the arrays start with room for. They grow when they fill up
+    def __init__(self, seed, capacity=64):
+        if numpy is None:
+            raise ImportError('The array-backed star field needs NumPy')
+        self.random = numpy.random.default_rng(seed)
+        # The number of slots in use. Slots past this are unused
+        self.count = 0
+        # Top left corner and diameter of each star
+        self.x = numpy.zeros(capacity, numpy.int32)
+        self.y = numpy.zeros(capacity, numpy.int32)
+        self.size = numpy.zeros(capacity, numpy.int32)
+        # Color of each star, one row of red, green and blue per star
+        self.color = numpy.zeros((capacity, 3), numpy.uint8)
+        # False while the star has twinkled off
+        self.visible = numpy.zeros(capacity, bool)
+        # The pixels covered by a star of each size, as offsets from its top left corner
+        self.squares = dict((size, numpy.indices((size, size)).reshape(2, -1)) for size in (3, 4, 5))
+
+    # The number of stars on the screen
+    def __len__(self):
+        return self.count
+
+    # Adds a star, in the same way as Star.reset
+    # @param y - The height to start the star at
+    def spawn(self, y=0):
+        if self.count == len(self.x):
+            # Doubles the size of every array when they are full
+            for name in ('x', 'y', 'size', 'color', 'visible'):
+                array = getattr(self, name)
+                setattr(self, name, numpy.concatenate((array, numpy.zeros_like(array))))
+        i = self.count
+        # The diameter, color and x position are drawn together. The color is rounded to steps of 16 as in Star
+        rolls = self.random.integers((3, 0, 0, 0, 0), (6, 81, 81, 81, 597))
+        self.size[i] = rolls[0]
+        self.color[i] = 255 - rolls[1:4] // 16 * 16
+        self.x[i] = rolls[4]
+        self.y[i] = y
+        self.visible[i] = True
+        self.count += 1
+
+    # Spawns, twinkles and moves every star, in the same way as Game.step and Star.update, using a single draw from
+    # the random number generator
+    def update(self):
+        n = self.count
+        rolls = self.random.random(n + 1)
+        # A star is spawned 1 time in 21, and each star twinkles 1 time in 121
+        if rolls[n] < 1 / 21:
+            self.spawn()
+        self.visible[:n] ^= rolls[:n] < 1 / 121
+        # Stars that moved off the bottom of the screen are removed, keeping the rest in order
+        n = self.count
+        keep = numpy.flatnonzero(self.y[:n] <= 700)
+        if len(keep) < n:
+            for name in ('x', 'y', 'size', 'color', 'visible'):
+                array = getattr(self, name)
+                array[:len(keep)] = array[keep]
+            n = self.count = len(keep)
+        # The rest move down by half their size, so bigger stars look closer and move faster
+        self.y[:n] += self.size[:n] // 2
+
+    # Draws every visible star straight into the pixels of the screen
+    # @param renderer - The Renderer to draw the stars on
+    # @param back - How far back towards its last position to draw each star, from 0 to 1
+    def draw(self, renderer, back=0.0):
+        n = self.count
+        shown = numpy.flatnonzero(self.visible[:n])
+        if len(shown) == 0:
+            return
+        # Smaller stars are drawn first so the bigger, closer stars are drawn over them
+        shown = shown[numpy.argsort(self.size[shown], kind='stable')]
+        size = self.size[shown]
+        x = self.x[shown]
+        y = self.y[shown]
+        if back:
+            y = y - numpy.rint(size // 2 * back).astype(y.dtype)
+        screen = renderer.screen
+        if screen.get_bytesize() == 3:
+            # surfarray can't reach single pixels of a 24 bit screen, so the stars are blitted instead
+            renderer.blits([(surface_cache.get((s, s), tuple(c)), (a, b))
+                            for a, b, s, c in zip(x.tolist(), y.tolist(), size.tolist(), self.color[shown].tolist())],
+                           False)
+            return
+        width, height = screen.get_size()
+        # The colors are turned into the screen's pixel format all at once
+        colors = pygame.surfarray.map_array(screen, self.color[shown])
+        pixels = pygame.surfarray.pixels2d(screen)
+        # Stars of each size cover the same square of pixels from their corner, so they are drawn a size at a time,
+        # leaving out the pixels off the edge of the screen
+        for s, (dx, dy) in self.squares.items():
+            same = numpy.flatnonzero(size == s)
+            px = (x[same, None] + dx).ravel()
+            py = (y[same, None] + dy).ravel()
+            inside = (px >= 0) & (px < width) & (py >= 0) & (py < height)
+            pixels[px[inside], py[inside]] = numpy.repeat(colors[same], s * s)[inside]
+        # The screen stays locked until the pixel array is gone
+        del pixels
+        if renderer.dirty:
+            renderer.mark(list(zip(x.tolist(), y.tolist(), size.tolist(), size.tolist())))
+
+    # Removes every star
+    def empty(self):
+        self.count = 0
+
+    # Returns a copy of the stars and the state of the random number generator
+    def snapshot(self):
+        n = self.count
+        return ([getattr(self, name)[:n].copy() for name in ('x', 'y', 'size', 'color', 'visible')],
+                self.random.bit_generator.state)
+
+    # Puts the stars back the way they were when a snapshot was taken
+    # @param state - The snapshot from snapshot
+    def restore(self, state):
+        arrays, self.random.bit_generator.state = state
+        for name, values in zip(('x', 'y', 'size', 'color', 'visible'), arrays):
+            array = getattr(self, name)
+            if len(array) < len(values):
+                array = numpy.zeros((len(values),) + array.shape[1:], array.dtype)
+                setattr(self, name, array)
+            array[:len(values)] = values
+        self.count = len(arrays[0])
+
+
+# Class that sorts sprites into a grid of cells so collisions only need to be checked against nearby sprites
+class SpatialHash:
+    # Constructor for the SpatialHash class
+    # @param cell_size - The width and height of each cell in pixels
+    def __init__(self, cell_size=32):
+        self.cell_size = cell_size
+        # Maps the coordinates of each cell to the sprites that overlap it, each with its order and rectangle
+        self.cells = {}
+        # The rectangle each sprite was added with, so it can be taken out of the right cells
+        self.rects = {}
+
+    # The number of sprites in the grid
+    def __len__(self):
+        return len(self.rects)
+
+    # Returns the coordinates of every cell a rectangle overlaps
+    # @param rect - The rectangle
+    def keys(self, rect):
+        size = self.cell_size
+        return [(x, y) for x in range(rect.left // size, (rect.right - 1) // size + 1)
+                for y in range(rect.top // size, (rect.bottom - 1) // size + 1)]
+
+    # Adds a sprite to the grid
+    # @param sprite - The sprite to add
+    # @param order - The sprite's position in its group, so the first one in the group can be found later
+    # @param rect - Where the sprite is in the grid. The sprite's own rectangle is used if it is not given
+    def add(self, sprite, order, rect=None):
+        rect = pygame.Rect(sprite.rect if rect is None else rect)
+        self.rects[sprite] = rect
+        for key in self.keys(rect):
+            cell = self.cells.get(key)
+            if cell is None:
+                self.cells[key] = {sprite: (order, rect)}
+            else:
+                cell[sprite] = (order, rect)
+
+    # Takes a sprite out of the grid
+    # @param sprite - The sprite to remove
+    def remove(self, sprite):
+        rect = self.rects.pop(sprite, None)
+        if rect is None:
+            return
+        for key in self.keys(rect):
+            cell = self.cells[key]
+            del cell[sprite]
+            if not cell:
+                del self.cells[key]
+
+    # Empties the grid
+    def clear(self):
+        self.cells = {}
+        self.rects = {}
+
+    # Clears the grid and adds every sprite in a group to it
+    # @param sprites - The group of sprites to add
+    def build(self, sprites):
+        self.clear()
+        for order, sprite in enumerate(sprites):
+            self.add(sprite, order)
+
+    # Finds the sprite that collides with a rectangle and its order
+    # Returns the sprite that comes first if more than one collides, or None if none do, and its order
+    # @param rect - The rectangle to check, in the grid's coordinates
+    def search(self, rect):
+        found = None
+        found_order = 0
+        for key in self.keys(rect):
+            cell = self.cells.get(key)
+            if cell is None:
+                continue
+            for sprite, (order, sprite_rect) in cell.items():
+                # Sprites that have been killed since they were added are skipped
+                if (found is None or order < found_order) and rect.colliderect(sprite_rect) and sprite.alive():
+                    found = sprite
+                    found_order = order
+        return found, found_order
+
+    # Finds the sprite that collides with a rectangle, in the same way as pygame.sprite.spritecollideany.
+    # If more than one sprite collides, the one that comes first in the group is returned
+    # @param rect - The rectangle to check
+    def first(self, rect):
+        return self.search(rect)[0]
+
+
+# Class that times each phase of every frame, keeping the times of the most recent frames in a ring buffer. While it
+# is disabled every call returns straight away, so it can be left in the game
+class FrameProfiler:
+    # Constructor for the FrameProfiler class
+    # @param size - The number of frames to keep the times of
+    # @param enabled - Whether every frame is timed from the start, so the times can be exported
+    def __init__(self, size=600, enabled=False):
+        self.size = size
+        # Whether every frame is timed for exporting, whether the times are shown on the screen, and whether the
+        # current frame is being timed. Frames are timed if either of the first two is on
+        self.exporting = enabled
+        self.show = False
+        self.enabled = enabled
+        # The names of the phases, in the order they were first timed
+        self.phases = []
+        # For each phase, when it started and how long it took on each frame in the buffer, in nanoseconds.
+        # Phases that didn't run on a frame have a time of -1
+        self.starts = {}
+        self.durations = {}
+        # The frame number of each frame in the buffer
+        self.frames = array.array('q', [-1] * size)
+        # The number of frames timed so far, the slot in the buffer for this frame and when the last phase ended
+        self.count = 0
+        self.slot = 0
+        self.last = 0
+        # The image of the times shown on the screen, which is only drawn again every 30 frames
+        self.image = None
+
+    # Turns showing the times on the screen on or off. Timing starts or stops at the next frame, so a frame is never
+    # timed from part way through. Frames are still timed while the times are hidden if they are being exported
+    def toggle(self):
+        self.show = not self.show
+        self.image = None
+
+    # Starts timing a frame
+    # @param frame - The frame number
+    def begin(self, frame):
+        self.enabled = self.exporting or self.show
+        if not self.enabled:
+            return
+        self.slot = self.count % self.size
+        self.frames[self.slot] = frame
+        for name in self.phases:
+            self.durations[name][self.slot] = -1
+        self.last = time.perf_counter_ns()
+
+    # Ends the current phase. The next phase starts straight away
+    # @param name - The name of the phase that just ended
+    def lap(self, name):
+        if not self.enabled:
+            return
+        now = time.perf_counter_ns()
+        durations = self.durations.get(name)
+        if durations is None:
+            self.phases.append(name)
+            durations = self.durations[name] = array.array('q', [-1] * self.size)
+            self.starts[name] = array.array('q', [0] * self.size)
+        # A phase can run more than once a frame when the game catches up on simulation steps, so its times add up
+        if durations[self.slot] < 0:
+            self.starts[name][self.slot] = self.last
+            durations[self.slot] = now - self.last
+        else:
+            durations[self.slot] += now - self.last
+        self.last = now
+
+    # Finishes timing a frame
+    def end(self):
+        if not self.enabled:
+            return
+        self.count += 1
+
+    # Returns the slots of the buffer in the order their frames were timed
+    def slots(self):
+        if self.count <= self.size:
+            return range(0, self.count)
+        return [(self.count + i) % self.size for i in range(0, self.size)]
+
+    # Returns the times of a phase that are in the buffer, in nanoseconds
+    # @param name - The name of the phase
+    def times(self, name):
+        durations = self.durations[name]
+        return [durations[i] for i in self.slots() if durations[i] >= 0]
+
+    # Returns the median and 99th percentile time of a phase in milliseconds
+    # @param name - The name of the phase
+    def percentiles(self, name):
+        times = sorted(self.times(name))
+        if not times:
+            return 0.0, 0.0
+        return times[len(times) // 2] / 1e6, times[min(len(times) - 1, len(times) * 99 // 100)] / 1e6
+
+    # Draws the times of each phase and the number of objects in the game in the corner of the screen
+    # @param renderer - The game's Renderer
+    # @param game - all the game data we need to access
+    def draw(self, renderer, game):
+        if not self.show:
+            return
+        if self.image is None or self.count % 30 == 0:
+            # Each line is split into columns that are drawn at fixed positions so the numbers line up
+            lines = [('phase', 'p50 ms', 'p99 ms')]
+            for name in self.phases:
+                lines.append((name,) + tuple('%.2f' % t for t in self.percentiles(name)))
+            lines.append(('enemies %d  projectiles %d  stars %d' % (len(game.enemies), len(game.projectiles),
+                                                                   len(game.stars)),))
+            # How full each pool is, which shows whether the sizes it starts with are large enough. The number in use
+            # is already on the line above
+            for name, pool in (('projectiles', game.projectiles), ('stars', game.stars)):
+                if isinstance(pool, Pool):
+                    stats = pool.stats()
+                    lines.append(('%s pool  free %d  peak %d  made %d' % (name, stats['free'], stats['high_water'],
+                                                                         stats['created']),))
+            self.image = pygame.Surface((300, 14 * len(lines) + 4), pygame.SRCALPHA)
+            self.image.fill((0, 0, 0, 160))
+            for i, line in enumerate(lines):
+                for text, x in zip(line, (2, 110, 170)):
+                    self.image.blit(text_cache.render(text, 12, (0, 255, 0)), (x, 2 + 14 * i))
+        renderer.blit(self.image, (0, 24))
+
+    # Writes the times in the buffer to a file
+    # @param path - The file to write to
+    # @param format - 'chrome' for a trace that can be opened in chrome://tracing or Perfetto, 'json' for a list of
+    #                 frames with the time of each phase, or 'csv' for a table with a row for each frame
+    def export(self, path, format='chrome'):
+        slots = self.slots()
+        if format == 'csv':
+            with open(path, 'w', newline='') as f:
+                writer = csv.writer(f)
+                writer.writerow(['frame'] + [name + '_ns' for name in self.phases])
+                for i in slots:
+                    writer.writerow([self.frames[i]] + [self.durations[name][i] for name in self.phases])
+            return
+        if format == 'json':
+            data = [dict([('frame', self.frames[i])] + [(name, self.durations[name][i]) for name in self.phases
+                                                         if self.durations[name][i] >= 0]) for i in slots]
+        elif format == 'chrome':
+            # Complete events with times in microseconds, one for each phase of each frame
+            events = []
+            for i in slots:
+                for name in self.phases:
+                    if self.durations[name][i] >= 0:
+                        events.append({'name': name, 'ph': 'X', 'pid': 1, 'tid': 1, 'ts': self.starts[name][i] / 1e3,
+                                       'dur': self.durations[name][i] / 1e3, 'args': {'frame': self.frames[i]}})
+            data = {'traceEvents': events, 'displayTimeUnit': 'ms'}
+        else:
+            raise ValueError('Unknown trace format: ' + format)
+        with open(path, 'w') as f:
+            json.dump(data, f)
+
+
+# Writes a whole number to a byte array using as few bytes as possible: 7 bits per byte, with the top bit set on
+# every byte except the last
+# @param out - The bytearray to write to
+# @param number - The number to write. It can't be negative
+def write_varint(out, number):
+    while number >= 0x80:
+        out.append((number & 0x7f) | 0x80)
+        number >>= 7
+    out.append(number)
+
+
+# Turns a whole number that may be negative into one that isn't, so it can be written with write_varint.
+# 0, -1, 1, -2, 2 become 0, 1, 2, 3, 4
+# @param number - The number to turn
+def zigzag(number):
+    return number * 2 if number >= 0 else -number * 2 - 1
+
+
+# Undoes zigzag
+# @param number - The number to turn back
+def unzigzag(number):
+    return number // 2 if number % 2 == 0 else -(number + 1) // 2
+
+
+# Reads a number written by write_varint
+# @param data - The bytes to read from
+# @param position - Where the number starts
+# Returns the number and the position just after it
+def read_varint(data, position):
+    number = 0
+    shift = 0
+    while True:
+        if position >= len(data):
+            raise ValueError('Replay file is cut short')
+        byte = data[position]
+        position += 1
+        number |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return number, position
+        shift += 7
+
+
+# Class that records the seed of a game and the player's input on every frame, which is all that is needed to play
+# the game again exactly. The input is stored as runs of frames with the same input bits, so long stretches of holding
+# a key or doing nothing take up a byte or two, and the runs are compressed since the same patterns keep repeating
+class Replay:
+    # The bytes every replay file starts with, followed by the version of the format.
+    # Version 2 added the balance settings. Version 3 has the same layout, but the stars got their own random number
+    # generator, so the games in older replays can't be played again the same way
+    MAGIC = b'GRPL'
+    VERSION = 3
+
+    # Constructor for the Replay class
+    # @param seed - The seed of the recorded game
+    # @param balance - The Balance settings of the recorded game
+    def __init__(self, seed, balance=None):
+        self.seed = seed
+        self.balance = Balance() if balance is None else balance
+        # Each run is a list of the input bits and the number of frames in a row they were used for
+        self.runs = []
+        # The frame each run starts on, used to find the input for any frame
+        self.starts = []
+        # The number of frames recorded
+        self.frames = 0
+
+    # Records the input for the next frame
+    # @param buttons - The input bits for the frame
+    def add(self, buttons):
+        if self.runs and self.runs[-1][0] == buttons:
+            self.runs[-1][1] += 1
+        else:
+            self.runs.append([buttons, 1])
+            self.starts.append(self.frames)
+        self.frames += 1
+
+    # Returns the input bits recorded for a frame, or 0 after the end of the recording
+    # @param frame - The frame number
+    def input(self, frame):
+        if frame >= self.frames:
+            return 0
+        return self.runs[bisect.bisect_right(self.starts, frame) - 1][0]
+
+    # Returns a controller that plays the recorded input back to a game
+    def player(self):
+        return lambda game: self.input(game.frame)
+
+    # Returns the replay as bytes
+    def encode(self):
+        out = bytearray(self.MAGIC)
+        out.append(self.VERSION)
+        # The seed is zigzag encoded so negative seeds also fit in a varint
+        write_varint(out, zigzag(self.seed))
+        write_varint(out, len(Balance.NAMES))
+        for name in Balance.NAMES:
+            write_varint(out, zigzag(getattr(self.balance, name)))
+        write_varint(out, len(self.runs))
+        runs = bytearray()
+        for buttons, length in self.runs:
+            # The input bits only need 4 bits, so they share a varint with the length of the run
+            write_varint(runs, length << 4 | buttons)
+        return bytes(out) + zlib.compress(bytes(runs), 9)
+
+    # Creates a replay from bytes made by encode
+    # @param data - The bytes to read
+    @classmethod
+    def decode(cls, data):
+        if data[:len(cls.MAGIC)] != cls.MAGIC:
+            raise ValueError('Not a replay file')
+        if len(data) <= len(cls.MAGIC):
+            raise ValueError('Replay file is cut short')
+        version = data[len(cls.MAGIC)]
+        # Older replays are turned away rather than played, since they would play a different game
+        if version != cls.VERSION:
+            raise ValueError('Unsupported replay version: %d' % version)
+        position = len(cls.MAGIC) + 1
+        seed, position = read_varint(data, position)
+        replay = cls(unzigzag(seed))
+        count, position = read_varint(data, position)
+        # Settings this version of the game doesn't know about would change how the game plays, so the replay
+        # couldn't be played back the same way
+        if count > len(Balance.NAMES):
+            raise ValueError('Replay has %d balance settings, but only %d are known' % (count, len(Balance.NAMES)))
+        for name in Balance.NAMES[:count]:
+            value, position = read_varint(data, position)
+            setattr(replay.balance, name, unzigzag(value))
+        count, position = read_varint(data, position)
+        try:
+            data = zlib.decompress(data[position:])
+        except zlib.error:
+            raise ValueError('Replay file is damaged')
+        position = 0
+        for i in range(0, count):
+            run, position = read_varint(data, position)
+            replay.runs.append([run & 0xf, run >> 4])
+            replay.starts.append(replay.frames)
+            replay.frames += run >> 4
+        return replay
+
+    # Writes the replay to a file
+    # @param path - The file to write to
+    def save(self, path):
+        with open(path, 'wb') as f:
+            f.write(self.encode())
+
+    # Reads a replay from a file
+    # @param path - The file to read
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            return cls.decode(f.read())
+
+
+# Class that plays a replay back as fast as possible. Every so often it saves a snapshot of the game, so it can jump
+# to any frame by going back to the closest snapshot and playing forward from there
+class ReplayPlayback:
+    # Constructor for the ReplayPlayback class
+    # @param replay - The Replay to play
+    # @param render - Whether to draw the game on every frame
+    # @param interval - The number of frames between snapshots
+    # @param options - Any other options for the Game
+    def __init__(self, replay, render=False, interval=600, **options):
+        self.replay = replay
+        self.interval = interval
+        self.game = Game(headless=True, seed=replay.seed, controller=replay.player(), render=render,
+                         balance=replay.balance, **options)
+        # The snapshots taken so far, by frame number
+        self.snapshots = {0: self.game.snapshot()}
+
+    # Plays the next frame of the replay
+    def step(self):
+        game = self.game
+        # Each frame is timed in the same way as a headless game, so a replay can be played again to profile it
+        game.profiler.begin(game.frame)
+        game.step(game.controller(game))
+        if game.render:
+            game.draw()
+        game.profiler.end()
+        if game.frame % self.interval == 0 and game.frame not in self.snapshots:
+            self.snapshots[game.frame] = game.snapshot()
+
+    # Moves the game to a frame of the replay
+    # @param frame - The frame to move to
+    def seek(self, frame):
+        frame = max(0, min(frame, self.replay.frames))
+        # Goes back to the closest snapshot if it is earlier than the frame or closer than where the game is now
+        closest = max(f for f in self.snapshots if f <= frame)
+        if closest > self.game.frame or frame < self.game.frame:
+            self.game.restore(self.snapshots[closest])
+        while self.game.frame < frame:
+            self.step()
+
+    # Plays the rest of the replay and returns the result of the game
+    def run(self):
+        self.seek(self.replay.frames)
+        game = self.game
+        return GameResult(game.score, game.lives, game.frame, game.won is True)
+
+
+# Class that holds the outcome of a finished game
+class GameResult:
+    # Constructor for the GameResult class
+    # @param score - The final score of the game
+    # @param lives - The number of lives the player had left
+    # @param frames - The number of frames that were simulated
+    # @param won - True if every enemy was destroyed, False if the player lost or the game was stopped early
+    def __init__(self, score, lives, frames, won):
+        self.score = score
+        self.lives = lives
+        self.frames = frames
+        self.won = won
+
+    def __repr__(self):
+        return 'GameResult(score=%d, lives=%d, frames=%d, won=%s)' % (self.score, self.lives, self.frames, self.won)
+
+
+# Plays back a fixed list of inputs, one per frame. Once the list runs out the player does nothing
+class ScriptedPlayer:
+    # Constructor for the ScriptedPlayer class
+    # @param inputs - A list of input bits (LEFT, RIGHT, FIRE, RELEASE) for each frame
+    def __init__(self, inputs):
+        self.inputs = inputs
+
+    # Returns the input for the current frame of the game
+    # @param game - all the game data we need to access
+    def __call__(self, game):
+        if game.frame < len(self.inputs):
+            return self.inputs[game.frame]
+        return 0
+
+
+# A simple computer player that lines up under an enemy and shoots at it
+class ChasePlayer:
+    # Constructor for the ChasePlayer class
+    def __init__(self):
+        # Set after a shot so the space bar is released on the next frame
+        self.fired = False
+
+    # Returns where an enemy will be by the time a projectile fired now travels up to it, including the formation
+    # turning around at the edges of the screen
+    # @param enemy - The enemy to aim at
+    # @param y - The y coordinate the projectile is fired from
+    # @param speed - How many pixels the projectile moves up each frame
+    def lead(self, enemy, y, speed):
+        f = enemy.formation
+        if f is None or f.min_x is None:
+            return enemy.rect.x
+        # The left edge of the formation bounces between f.left and the point where its right edge reaches f.right
+        left = f.min_x + f.shift
+        span = f.right - f.left - (f.max_x - f.min_x)
+        position = left - f.left + f.direction * ((y - enemy.rect.y) // max(speed, 1))
+        if span > 0:
+            position %= 2 * span
+            if position > span:
+                position = 2 * span - position
+        else:
+            position = 0
+        return f.left + position + enemy.rect.x - left
+
+    # Returns the input for the current frame of the game
+    # @param game - all the game data we need to access
+    def __call__(self, game):
+        buttons = 0
+        if self.fired:
+            buttons |= RELEASE
+            self.fired = False
+        ship = game.ship.rect
+        target = None
+        aim = 0
+        for e in game.enemies:
+            x = self.lead(e, ship.y, game.balance.friendly_speed)
+            if target is None or abs(x - ship.x) < abs(aim - ship.x):
+                target = e
+                aim = x
+        if target is None:
+            return buttons
+        if aim < ship.x - 5:
+            buttons |= LEFT
+        elif aim > ship.x + 5:
+            buttons |= RIGHT
+        elif not buttons & RELEASE:
+            buttons |= FIRE
+            self.fired = True
+        return buttons
+
+
 # Class that handles all the objects and player inputs
 class Game:
     # Constructor for the game class
-    def __init__(self):
-        pygame.init()
-        pygame.key.set_repeat(50)
-        # Loads the background song "Space Oddity 8 bit"
-        pygame.mixer.music.load('assets/Space_Oddity.mp3')
-        pygame.mixer.music.set_volume(1)
-        # Plays the song indefinitely
-        pygame.mixer.music.play(-1)
+    # @param headless - Runs the game without a window, sound or frame cap, using SDL's dummy drivers
+    # @param seed - Seed for the game's random number generator. The same seed and inputs always play the same game
+    # @param controller - A function called every frame with the game that returns the input bits for that frame.
+    #                     If it is not given the input is read from the keyboard
+    # @param render - Whether the game is drawn every frame. Defaults to True unless the game is headless
+    # @param max_frames - Stops the game after this many frames, if given
+    # @param arrays - Keeps the projectiles in a NumPy ProjectileStore instead of a sprite group
+    # @param dirty - Only updates the parts of the screen that changed each frame instead of flipping the whole screen
+    # @param profile - Times every phase of each frame from the start. The times can be shown by pressing F3
+    # @param record - Records the game into a Replay, kept in self.recording
+    # @param balance - The Balance settings for the game. The normal settings are used if it is not given
+    # @param step_rate - The number of simulation steps per second. The game moves at the same speed whatever rate
+    #                    it is drawn at. Headless games take one step per frame as fast as possible
+    # @param fps - The most frames drawn per second, or 0 to draw as many as the computer can. Frames drawn between
+    #              simulation steps show the objects part of the way between their last two positions
+    # @param lag - What to do when drawing falls behind the simulation: 'catchup' runs every missed step,
+    #              'cap' runs at most max_steps per frame and leaves the rest for later frames, and
+    #              'skip' runs at most max_steps per frame and drops the rest, slowing the game down instead
+    # @param max_steps - The most simulation steps run per frame when lag is 'cap' or 'skip'
+    # @param audio_cache - The folder decoded sounds are kept in between launches, or None to not keep them
+    # @param projectile_pool - The number of projectiles the pool starts with, when they are not kept in NumPy arrays
+    # @param star_pool - The number of stars there is room for from the start
+    def __init__(self, headless=False, seed=None, controller=None, render=None, max_frames=None, arrays=False,
+                 dirty=False, profile=False, record=False, balance=None, step_rate=60, fps=60, lag='catchup',
+                 max_steps=5, audio_cache='.cache/audio', projectile_pool=64, star_pool=64):
+        # When the game started being set up, and how many seconds after that the first frame was shown and the
+        # game could be played
+        self.started = time.perf_counter()
+        self.first_frame = None
+        self.interactive = None
+        self.headless = headless
+        self.controller = controller
+        self.render = not headless if render is None else render
+        self.max_frames = max_frames
+        self.arrays = arrays
+        self.balance = Balance() if balance is None else balance
+        if lag not in ('catchup', 'cap', 'skip'):
+            raise ValueError('Unknown lag setting: ' + lag)
+        self.step_rate = step_rate
+        self.fps = fps
+        self.lag = lag
+        self.max_steps = max_steps
+        if self.headless:
+            # The dummy drivers let the game run on a machine without a display or a sound card
+            os.environ['SDL_VIDEODRIVER'] = 'dummy'
+            os.environ['SDL_AUDIODRIVER'] = 'dummy'
+            # Only the parts of pygame needed to simulate and draw the game are started, leaving the mixer off
+            pygame.display.init()
+            pygame.font.init()
+        else:
+            # The mixer is started by the asset loader, since opening the audio device can take a while
+            pygame.display.init()
+            pygame.font.init()
+            pygame.key.set_repeat(50)
+        # Creates the sound bank, filled in once the sound effects are loaded
+        self.sounds = SoundBank()
+        # Loads the fonts, the sound effects and the background song "Space Oddity 8 bit" on another thread while
+        # the window is opened. Headless games have no audio and load the fonts straight away
+        self.assets = AssetLoader(self.sounds, 'assets/Space_Oddity.mp3', audio_cache, audio=not headless)
+        self.assets.start(background=not headless)
+        # Every random decision in the game comes from this generator so a game can be repeated from its seed.
+        # A seed is picked if none was given so the game can still be recorded
+        if seed is None:
+            seed = random.getrandbits(32)
+        self.seed = seed
+        self.random = random.Random(seed)
+        self.recording = Replay(seed, self.balance) if record else None
         # Starts the game clock
         self.clock = pygame.time.Clock()
+        # Times each phase of the game loop
+        self.profiler = FrameProfiler(enabled=profile)
         # Sets the game screen to 600 by 700 pixels
         self.screen = pygame.display.set_mode((600, 700))
         # Sets the end screen to 600 by 700 pixels
         self.end_screen = pygame.display.set_mode((600, 700))
-        # Defines a new life event
-        self.new_life_event = pygame.event.Event(pygame.USEREVENT + 1)
+        # Images made before the screen existed are converted to its pixel format
+        surface_cache.convert()
+        # Draws everything to the screen and puts it on the display
+        self.renderer = Renderer(self.screen, dirty)
         # Intitializes the player ship
         self.ship = Ship()
         # Creates a group for all the enemy ships
         self.enemies = pygame.sprite.Group()
-        # Creates a group for all projectiles
-        self.projectiles = pygame.sprite.Group()
-        # Creates a group for all the background stars
-        self.stars = pygame.sprite.Group()
+        # Creates a pool for all projectiles, or the arrays that hold them
+        if self.arrays:
+            self.projectiles = ProjectileStore(self.sounds)
+        else:
+            self.projectiles = Pool(Projectile, projectile_pool)
+        # Creates the background stars. They have their own random number generator so the same seed plays the same
+        # game whichever way the stars are kept. With NumPy they are kept in arrays, otherwise in a pool of sprites
+        star_seed = self.random.getrandbits(64)
+        if numpy is not None:
+            self.stars = StarField(star_seed, star_pool)
+            self.star_random = None
+        else:
+            self.stars = Pool(Star, star_pool)
+            self.star_random = random.Random(star_seed)
+        # Decides when each enemy will fire a projectile
+        self.fire_scheduler = FireScheduler(self.balance.shot_multiplier)
         # Initializes the overlay
         self.overlay = Overlay()
         # Sets the game screen and end screen to black
@@ -295,133 +1810,504 @@ class Game:
         self.end_screen.fill((0, 0, 0))
         self.ready = True
         self.score = 0
-        self.lives = 3
+        self.lives = self.balance.lives
+        # The number of frames that have been simulated
+        self.frame = 0
+        self.done = False
+        # Set to True or False once the game has been won or lost
+        self.won = None
+        # This bool is used to determine if the user is holding the space bar. This is used to ensure that
+        # only one friendly projectile is created every time the spacebar is pressed
+        self.space_held = False
+        # The formations of enemies in this wave
+        self.formations = []
         # Creates a grid of 60 enemies
-        for i in range(0, 10):
-            for j in range(0, 6):
+        self.build_wave(self.balance.columns, self.balance.rows, self.balance.formations)
+
+    # Replaces the enemies with a new wave. The rows are split into formations that each move on their own
+    # @param columns - The number of enemies in each row
+    # @param rows - The number of rows of enemies
+    # @param formations - The number of formations, each flying a band of rows next to each other. There can't be more
+    #                     formations than rows
+    def build_wave(self, columns, rows, formations=1):
+        for e in self.enemies:
+            e.kill()
+        count = max(1, min(formations, rows))
+        # Every other formation starts moving left, so the formations pass each other instead of moving as one
+        self.formations = [Formation(direction=1 if k % 2 == 0 else -1) for k in range(0, count)]
+        # The enemies are 50 pixels apart, or closer if there are too many to fit on the screen
+        dx = min(50, 540 // max(columns, 1))
+        dy = min(50, 300 // max(rows, 1))
+        for i in range(0, columns):
+            for j in range(0, rows):
                 # The ship's color is determined by its coordinate values, establishing the pretty array of colors
                 # seen in the game
-                enemy = Enemy([int(i*25), int(j*40), int(120+i*j/5)], [int(40+i*50), int(40+j*50)])
-                # Adds each enemy to the enemies group
+                color = [min(255, int(i*25)), min(255, int(j*40)), min(255, int(120+i*j/5))]
+                enemy = Enemy(color, [int(40+i*dx), int(40+j*dy)])
+                # Adds each enemy to the enemies group and to the formation flying its row
                 self.enemies.add(enemy)
+                self.formations[j * count // rows].add(enemy, len(self.enemies) - 1)
 
-    # Runs the game
-    def run(self):
-        self.done = False
-        # This bool is used to determine if the user is holding the space bar. This is used to ensure that
-        # only one friendly projectile is created every time the spacebar is pressed
-        self.space_held = False
-        # While loop to run the game
-        while not self.done:
-            # Clears the screen of all objects so they can be accurately redrawn
-            self.screen.fill((0, 0, 0))
-            # Handles all events such as player inputs and object collisions
-            for event in pygame.event.get():
-                # Handles if the player was hit by an enemy projectile
-                if event.type == self.new_life_event.type:
-                    # Takes a life from the player
-                    self.lives -= 1
-                    # The player loses the game if they run out of lives
-                    if self.lives == 0:
-                        # Initializes the end screen with the player having lost the game and passing in the final score
-                        end = EndScreen(False, self.score)
-                        # Draws the end screen
-                        end.draw(self.end_screen)
-                        # Puts the end screen on the display
-                        pygame.display.flip()
-                        # Leaves the end screen up for ten seconds before closing the program
-                        time.sleep(10)
-                        pygame.quit()
-                        sys.exit(0)
-                # Exits the program if the user hits the X button
-                if event.type == pygame.QUIT:
-                    pygame.quit()
-                    sys.exit(0)
-                # Handles all player inputs
-                if event.type == pygame.KEYDOWN:
-                    # Moves the ship left if the player presses the left arrow key
-                    if event.key == pygame.K_LEFT:
-                        # Moves the ship left 5 pixels
-                        self.ship.rect.x -= 5
-                        # If the ship is on the left edge of the screen, it will not move
-                        if self.ship.rect.x < 0:
-                            self.ship.rect.x = 0
-                    # Moves the ship right if the player presses the right arrow key
-                    if event.key == pygame.K_RIGHT:
-                        # Moves the ship right 5 pixels
-                        self.ship.rect.x += 5
-                        # If the ship is on the right edge of the screen, it will not move
-                        if self.ship.rect.x > 580:
-                            self.ship.rect.x = 580
-                    # Handles the playe pressing the space bar
-                    if event.key == pygame.K_SPACE:
-                        # Int variable to hold the number of friendly shots currently on the screen
-                        shotcount = 0
-                        # Runs through all the projectiles in the game
-                        for p in self.projectiles:
-                            # Increments shotcount if the projectile was fired by the player
-                            if p.friendly:
-                                shotcount += 1
-                        # Fires a friendly projectile, but only if space was not held and if there are 6 or less
-                        # friendly projectiles in play. I decided to limit the number of projectiles the player
-                        # can have on the screen because otherwise the player can repeatedly press the space bar and
-                        # fire a ridiculous number of shots, making the game extremely easy
-                        if not self.space_held and shotcount <= 6:
-                            # Creates a friendly projectile from the middle of the ship moving directly upward
-                            projectile = Projectile([self.ship.rect.x+10, self.ship.rect.y], [0, -4], True)
-                            # Adds the projectile to the projectiles group
-                            self.projectiles.add(projectile)
-                            # Toggles the space_held bool
-                            self.space_held = True
-                # Detects when a key is released
-                if event.type == pygame.KEYUP:
-                    if event.key == pygame.K_SPACE:
-                        # When the player releases the space bar, the space_held bool is toggle, signifying that
-                        # the player may fire another projectile
-                        self.space_held = False
-            # Determines if a star will be spawned on this clock tick, based on a random int from 0 to 20
-            if random.randint(0, 20) == 1:
-                # Creates a star and adds it to the stars group
-                star = Star()
-                self.stars.add(star)
-            # Determines if each enemy will fire a projectile
-            for e in self.enemies:
-                e.shoot(game)
-            # Updates the states and locations of all projectiles
+    # Reads the keyboard and turns the events since the last frame into input bits
+    def read_input(self):
+        buttons = 0
+        for event in pygame.event.get():
+            # Exits the game if the user hits the X button
+            if event.type == pygame.QUIT:
+                self.done = True
+            # Handles all player inputs
+            if event.type == pygame.KEYDOWN:
+                if event.key == pygame.K_LEFT:
+                    buttons |= LEFT
+                if event.key == pygame.K_RIGHT:
+                    buttons |= RIGHT
+                if event.key == pygame.K_SPACE:
+                    buttons |= FIRE
+                # Shows or hides the time taken by each part of the game loop
+                if event.key == pygame.K_F3:
+                    self.profiler.toggle()
+            # Detects when a key is released
+            if event.type == pygame.KEYUP:
+                if event.key == pygame.K_SPACE:
+                    buttons |= RELEASE
+        return buttons
+
+    # Moves the ship and fires projectiles based on the player's input
+    # @param buttons - The input bits for this frame
+    def apply_input(self, buttons):
+        self.ship.previous_x = self.ship.rect.x
+        # Moves the ship left if the player presses the left arrow key
+        if buttons & LEFT:
+            # Moves the ship left 5 pixels
+            self.ship.rect.x -= self.balance.ship_speed
+            # If the ship is on the left edge of the screen, it will not move
+            if self.ship.rect.x < 0:
+                self.ship.rect.x = 0
+        # Moves the ship right if the player presses the right arrow key
+        if buttons & RIGHT:
+            # Moves the ship right 5 pixels
+            self.ship.rect.x += self.balance.ship_speed
+            # If the ship is on the right edge of the screen, it will not move
+            if self.ship.rect.x > 580:
+                self.ship.rect.x = 580
+        # Handles the playe pressing the space bar
+        if buttons & FIRE:
+            # Int variable to hold the number of friendly shots currently on the screen
+            shotcount = self.friendly_shots()
+            # Fires a friendly projectile, but only if space was not held and if there are 6 or less
+            # friendly projectiles in play. I decided to limit the number of projectiles the player
+            # can have on the screen because otherwise the player can repeatedly press the space bar and
+            # fire a ridiculous number of shots, making the game extremely easy
+            if not self.space_held and shotcount <= self.balance.max_friendly_shots:
+                # Creates a friendly projectile from the middle of the ship moving directly upward
+                self.fire([self.ship.rect.x+10, self.ship.rect.y], [0, -self.balance.friendly_speed], True)
+                # Toggles the space_held bool
+                self.space_held = True
+        if buttons & RELEASE:
+            # When the player releases the space bar, the space_held bool is toggle, signifying that
+            # the player may fire another projectile
+            self.space_held = False
+
+    # Creates a projectile and adds it to the game
+    # @param position - a tuple containing the starting coordinates for the projectile
+    # @param vector - a tuple containing the x and y velocities of the projectile
+    # @param friendly - a bool determining whether the projectile was fired by the player or by an enemy
+    def fire(self, position, vector, friendly):
+        if self.arrays:
+            self.projectiles.spawn(position, vector, friendly)
+        else:
+            self.projectiles.acquire().reset(position, vector, friendly, self.sounds)
+
+    # Returns the number of projectiles fired by the player that are still on the screen
+    def friendly_shots(self):
+        if self.arrays:
+            return self.projectiles.friendly_count()
+        shotcount = 0
+        # Runs through all the projectiles in the game
+        for p in self.projectiles:
+            # Increments shotcount if the projectile was fired by the player
+            if p.friendly:
+                shotcount += 1
+        return shotcount
+
+    # Finds and handles every projectile that hit a ship this frame
+    def collide(self):
+        if self.arrays:
+            self.projectiles.collide(self)
+            return
+        for p in self.projectiles:
+            # Only projectiles fired by the player can hit an enemy. Therefore, enemy projectiles
+            # will go through other enemies.
+            if p.friendly:
+                hitObject = self.enemy_at(p.rect)
+                if hitObject:
+                    # Removes the hit enemy from the game and the enemies group
+                    hitObject.kill()
+                    # Puts the projectile back into the game's projectile pool
+                    self.projectiles.release(p)
+                    # Adds 1 to the player's score
+                    self.score += 1
+                    # Plays the collision sound effect
+                    self.sounds.play('explosion')
+            # Only projectiles fired from an enemy can hit the player ship
+            elif p.rect.colliderect(self.ship.rect):
+                # Puts the projectile back into the game's projectile pool
+                self.projectiles.release(p)
+                # Takes a life from the player. The game ends once there are none left
+                self.lives -= 1
+                # Plays the collision sound effect
+                self.sounds.play('explosion')
+
+    # Finds the enemy that collides with a rectangle, in the same way as pygame.sprite.spritecollideany
+    # Returns the enemy that comes first in the enemies group if more than one collides, or None if none do
+    # @param rect - The rectangle to check
+    def enemy_at(self, rect):
+        found = None
+        found_order = 0
+        for f in self.formations:
+            enemy, order = f.search(rect)
+            if enemy is not None and (found is None or order < found_order):
+                found = enemy
+                found_order = order
+        return found
+
+    # Returns a copy of everything that changes as the game is played, which restore can put back later
+    def snapshot(self):
+        state = {
+            'frame': self.frame, 'score': self.score, 'lives': self.lives, 'done': self.done, 'won': self.won,
+            'space_held': self.space_held, 'random': self.random.getstate(), 'ship': self.ship.rect.topleft,
+            # The enemies are kept in the order they are in the group, since that decides which one is hit first
+            'enemies': [(e, e.rect.topleft) for e in self.enemies],
+            'formations': [(f, f.direction, f.shift, dict(f.columns), f.min_x, f.max_x, f.enemies.sprites())
+                           for f in self.formations],
+            'fire_scheduler': (list(self.fire_scheduler.queue), self.fire_scheduler.count),
+        }
+        if self.star_random is None:
+            state['stars'] = self.stars.snapshot()
+        else:
+            state['stars'] = ([(s.rect.topleft, s.size, s.color, s.image_filled) for s in self.stars],
+                              self.star_random.getstate())
+        if self.arrays:
+            store = self.projectiles
+            state['projectiles'] = [getattr(store, name)[:store.count].copy()
+                                    for name in ('x', 'y', 'vx', 'vy', 'w', 'h', 'friendly', 'alive')]
+        else:
+            state['projectiles'] = [(p.rect.topleft, p.vector, p.friendly) for p in self.projectiles]
+        return state
+
+    # Puts the game back to the way it was when a snapshot was taken
+    # @param state - The snapshot from snapshot
+    def restore(self, state):
+        self.frame = state['frame']
+        self.score = state['score']
+        self.lives = state['lives']
+        self.done = state['done']
+        self.won = state['won']
+        self.space_held = state['space_held']
+        self.random.setstate(state['random'])
+        self.ship.rect.topleft = state['ship']
+        self.enemies.empty()
+        for e, position in state['enemies']:
+            e.rect.topleft = position
+            self.enemies.add(e)
+        for f, direction, shift, columns, min_x, max_x, enemies in state['formations']:
+            f.direction = direction
+            f.shift = shift
+            f.columns = dict(columns)
+            f.min_x = min_x
+            f.max_x = max_x
+            f.enemies.empty()
+            for e in enemies:
+                e.formation = f
+                f.enemies.add(e)
+            f.rebuild()
+        queue, self.fire_scheduler.count = state['fire_scheduler']
+        self.fire_scheduler.queue = list(queue)
+        if self.star_random is None:
+            self.stars.restore(state['stars'])
+        else:
+            self.restore_stars(state['stars'])
+        if self.arrays:
+            store = self.projectiles
+            store.count = 0
+            for name, values in zip(('x', 'y', 'vx', 'vy', 'w', 'h', 'friendly', 'alive'), state['projectiles']):
+                array = getattr(store, name)
+                if len(array) < len(values):
+                    array = numpy.zeros(len(values), array.dtype)
+                    setattr(store, name, array)
+                array[:len(values)] = values
+                store.count = len(values)
+        else:
+            self.projectiles.empty()
+            for position, vector, friendly in state['projectiles']:
+                p = self.projectiles.acquire()
+                p.friendly = friendly
+                p.image = surface_cache.get((4, 10), (255, 255, 255) if friendly else (255, 0, 0))
+                p.rect.topleft = position
+                p.vector = vector
+        # Everything on the screen has moved, so the next frame has to be drawn in full
+        self.renderer.full = True
+
+    # Puts the pool of star sprites back the way it was, for games without NumPy
+    # @param state - The stars and the state of their random number generator from snapshot
+    def restore_stars(self, state):
+        stars, random_state = state
+        self.star_random.setstate(random_state)
+        self.stars.empty()
+        for position, size, color, image_filled in stars:
+            star = self.stars.acquire()
+            star.size = size
+            star.color = color
+            star.image_filled = image_filled
+            star.image = surface_cache.get((size, size), color if image_filled else (0, 0, 0))
+            star.rect.size = (size, size)
+            star.rect.topleft = position
+
+    # Adds a star to the background
+    # @param y - The height to start the star at
+    def add_star(self, y=0):
+        if self.star_random is None:
+            self.stars.spawn(y)
+        else:
+            self.stars.acquire().reset(self.star_random).rect.y = y
+
+    # Simulates a single frame of the game
+    # @param buttons - The input bits for this frame
+    def step(self, buttons):
+        if self.recording is not None:
+            self.recording.add(buttons)
+        lap = self.profiler.lap
+        self.apply_input(buttons)
+        lap('input')
+        # Determines if a star will be spawned on this clock tick, based on a random int from 0 to 20. The star
+        # field does this itself when it updates
+        if self.star_random is not None and self.star_random.randint(0, 20) == 1:
+            # Takes a star from the pool and places it at the top of the screen
+            self.add_star()
+        # Fires the projectiles of the enemies whose shots are due
+        self.fire_scheduler.update(self)
+        lap('enemy_fire')
+        # Handles all the projectiles that hit a ship
+        self.collide()
+        lap('collisions')
+        # Updates the states and locations of all projectiles
+        if self.arrays:
+            self.projectiles.update()
+        else:
             for p in self.projectiles:
-                p.update(game)
-            # Determines whether or not the enemy ships will need to change direction
-            for e in self.enemies:
-                modifier = Enemy.changeDirection(e, self.enemies)
-                break
-            # Changes each enemy's direction if necessary, leaves them unchanged otherwise
-            for e in self.enemies:
-                e.direction *= modifier
-            # Update all object groups and redraws them in the correct position
-            self.enemies.update(self.screen)
+                p.update(self)
+        lap('projectiles')
+        # Turns each formation around if it reached the edge of the screen and moves its enemies
+        for f in self.formations:
+            f.update()
+        lap('formations')
+        # Update all object groups to their new positions
+        if self.star_random is None:
+            self.stars.update()
+        else:
+            for s in self.stars:
+                s.update(self.stars, self.star_random)
+        lap('stars')
+        self.frame += 1
+        # The player loses the game if they run out of lives
+        if self.lives <= 0:
+            self.won = False
+            self.done = True
+        # Detects if all the enemies have been eliminated
+        elif len(self.enemies) == 0:
+            self.won = True
+            self.done = True
+        # Stops the game if it has run for as long as it was allowed to
+        elif self.max_frames is not None and self.frame >= self.max_frames:
+            self.done = True
+
+    # Draws every object in the game to the screen
+    # @param alpha - How far the game is from the last simulation step to the next one, from 0 to 1. Moving objects
+    #                are drawn that far along the way from their last position to where they are now
+    def draw(self, alpha=1.0):
+        back = 1.0 - alpha
+        # The overlay stays blank until its font is loaded. It is updated first so that if its text changed, the old
+        # text is cleared along with everything else
+        if self.assets.ready.is_set():
             self.overlay.update(self.score, self.lives)
-            self.stars.update(self.stars)
-            self.stars.draw(self.screen)
-            self.ship.draw(self.screen)
-            self.enemies.draw(self.screen)
-            self.projectiles.draw(self.screen)
-            self.overlay.draw(self.screen)
+        if self.overlay.changed:
+            self.renderer.invalidate(self.overlay.rect)
+        # Clears the screen, or only the parts of it that were drawn on, so everything can be accurately redrawn
+        self.renderer.begin()
+        self.stars.draw(self.renderer, back)
+        self.ship.draw(self.renderer, back)
+        # Each kind of object is drawn with a single call rather than one blit per sprite
+        if back:
+            self.renderer.blits([(e.image, (e.rect.x - round(e.formation.moved * back), e.rect.y))
+                                 for e in self.enemies], False)
+        else:
+            self.renderer.blits([(e.image, e.rect) for e in self.enemies], False)
+        self.projectiles.draw(self.renderer, back)
+        self.profiler.draw(self.renderer, self)
+        self.overlay.draw(self.renderer)
+        self.profiler.lap('draw')
+        self.renderer.present()
+        self.profiler.lap('present')
+        if self.first_frame is None:
+            self.first_frame = time.perf_counter() - self.started
+
+    # Runs the game until it is won, lost or closed
+    # Returns a GameResult with the final state of the game
+    def run(self):
+        # Headless games run one step per frame as fast as possible, rather than at step_rate steps per second
+        if self.headless:
+            self.run_headless()
+        else:
+            self.run_fixed_step()
+        if self.won is not None and not self.headless:
+            self.end_screen.fill((0, 0, 0))
+            # Initializes the end screen and passes the end score
+            end = EndScreen(self.won, self.score)
+            # Displays the end screen
+            end.draw(self.end_screen)
             pygame.display.flip()
-            self.clock.tick(60)
-            # Detects if all the enemies have been eliminated
-            if len(self.enemies) == 0:
-                self.end_screen.fill((0, 0, 0))
-                # Initializes the end screen for a won game and passes the end score
-                end = EndScreen(True, self.score)
-                # Displays the end screen
-                end.draw(self.end_screen)
-                pygame.display.flip()
-                # Waits ten seconds before closing the program
-                time.sleep(10)
-                pygame.quit()
-                sys.exit(0)
+            # Leaves the end screen up for ten seconds before closing the program
+            time.sleep(10)
+        return GameResult(self.score, self.lives, self.frame, self.won is True)
+
+    # Starts the game once everything is loaded
+    def start(self):
+        self.interactive = time.perf_counter() - self.started
+        if self.assets.music_file is not None:
+            pygame.mixer.music.set_volume(1)
+            # Plays the song indefinitely
+            pygame.mixer.music.play(-1)
+
+    # Runs the game one simulation step per frame, as fast as possible
+    def run_headless(self):
+        self.start()
+        while not self.done:
+            self.profiler.begin(self.frame)
+            if self.controller is None:
+                buttons = self.read_input()
+            else:
+                buttons = self.controller(self)
+            self.profiler.lap('events')
+            if self.done:
+                break
+            self.step(buttons)
+            if self.render:
+                self.draw()
+            self.profiler.end()
+
+    # Runs the simulation at step_rate steps per second however fast frames are drawn. The time since the last frame
+    # is added up and a step is taken for every 1/step_rate seconds of it, with what is left over used to draw the
+    # objects between their last two positions
+    def run_fixed_step(self):
+        step_time = 1.0 / self.step_rate
+        # The first frame takes a step straight away
+        accumulator = step_time
+        previous = time.perf_counter()
+        # The buttons pressed since the last step. They are kept for the next step so no key press is missed
+        pending = 0
+        while not self.done:
+            self.profiler.begin(self.frame)
+            # The keyboard is still read when a controller is playing so the window can be closed
+            pending |= self.read_input()
+            self.profiler.lap('events')
+            if self.done:
+                break
+            if self.interactive is None and self.assets.ready.is_set():
+                self.start()
+            now = time.perf_counter()
+            if self.interactive is None:
+                # Nothing moves until everything is loaded, but the screen is still drawn and the window can be closed
+                pending = 0
+                steps = 0
+            else:
+                accumulator += now - previous
+                steps = int(accumulator / step_time)
+            previous = now
+            if self.lag == 'catchup':
+                # Catching up is still limited to a second of steps so a long pause can't freeze the game
+                limit = self.step_rate
+            else:
+                limit = self.max_steps
+            if steps > limit:
+                # Capping keeps the missed time to run on later frames, while skipping throws it away
+                if self.lag == 'cap':
+                    accumulator = min(accumulator, self.step_rate * step_time)
+                else:
+                    accumulator = limit * step_time + accumulator % step_time
+                steps = limit
+            for i in range(0, steps):
+                if self.controller is not None:
+                    buttons = self.controller(self)
+                else:
+                    buttons = pending
+                # Held keys are read again each frame, so the buttons pressed are only used by one step
+                pending = 0
+                self.step(buttons)
+                accumulator -= step_time
+                if self.done:
+                    break
+            if self.render:
+                self.draw(min(accumulator / step_time, 1.0))
+            self.clock.tick(self.fps)
+            self.profiler.lap('tick')
+            self.profiler.end()
 
 
 if __name__ == "__main__":
-    game = Game()
-    game.run()
+    parser = argparse.ArgumentParser(description='Gallaga')
+    parser.add_argument('--headless', action='store_true',
+                        help='simulate games without a window or sound, as fast as possible')
+    parser.add_argument('--seed', type=int, default=None, help='seed for the random number generator')
+    parser.add_argument('--games', type=int, default=1, help='number of headless games to play')
+    parser.add_argument('--max-frames', type=int, default=None, help='stop each game after this many frames')
+    parser.add_argument('--arrays', action='store_true', help='keep the projectiles in NumPy arrays')
+    parser.add_argument('--dirty', action='store_true',
+                        help='only update the parts of the screen that changed instead of flipping the whole screen')
+    parser.add_argument('--profile', metavar='PATH', default=None,
+                        help='time each phase of the game loop and write the last 600 frames to PATH')
+    parser.add_argument('--profile-format', choices=['chrome', 'json', 'csv'], default='chrome',
+                        help='format of the profile written by --profile')
+    parser.add_argument('--record', metavar='PATH', default=None,
+                        help='record the game to a replay file. Headless games after the first are numbered')
+    parser.add_argument('--replay', metavar='PATH', default=None,
+                        help='play a replay file back as fast as possible and print the result')
+    parser.add_argument('--render', action='store_true', help='draw every frame while playing a replay')
+    parser.add_argument('--fps', type=int, default=60, help='most frames drawn per second, 0 for no limit')
+    parser.add_argument('--lag', choices=['catchup', 'cap', 'skip'], default='catchup',
+                        help='what to do with missed simulation steps when drawing falls behind')
+    parser.add_argument('--max-steps', type=int, default=5,
+                        help='most simulation steps per frame with --lag cap or skip')
+    args = parser.parse_args()
+    if args.replay is not None:
+        start = time.perf_counter()
+        playback = ReplayPlayback(Replay.load(args.replay), render=args.render, arrays=args.arrays,
+                                  profile=args.profile is not None)
+        print(playback.run())
+        print('%d frames in %.2f seconds' % (playback.replay.frames, time.perf_counter() - start))
+        game = playback.game
+    elif args.headless:
+        # Headless games are played by the computer, each with the next seed
+        for n in range(0, args.games):
+            seed = None if args.seed is None else args.seed + n
+            game = Game(headless=True, seed=seed, controller=ChasePlayer(), max_frames=args.max_frames,
+                        arrays=args.arrays, profile=args.profile is not None, record=args.record is not None)
+            print(game.run())
+            if args.record is not None:
+                root, ext = os.path.splitext(args.record)
+                game.recording.save(args.record if n == 0 else '%s-%d%s' % (root, n, ext))
+    else:
+        game = Game(seed=args.seed, arrays=args.arrays, dirty=args.dirty, profile=args.profile is not None,
+                    record=args.record is not None, fps=args.fps, lag=args.lag, max_steps=args.max_steps)
+        game.run()
+        for error in game.assets.errors:
+            print(error, file=sys.stderr)
+        if game.interactive is not None:
+            print('first frame after %.3f seconds, playable after %.3f seconds (assets loaded in %.3f seconds)'
+                  % (game.first_frame, game.interactive, game.assets.duration))
+        if args.record is not None:
+            game.recording.save(args.record)
+    if args.profile is not None:
+        game.profiler.export(args.profile, args.profile_format)
+    if not args.headless and args.replay is None:
+        pygame.quit()
+        sys.exit(0)
@@ -0,0 +1,178 @@
+import argparse
+import json
+import math
+import os
+import sys
+import time
+import tracemalloc
+
+from Gallaga import Balance, ChasePlayer, Game
+
+
+# Class that describes a stress scenario for the game loop
+class Scenario:
+    # Constructor for the Scenario class
+    # @param name - The name the scenario is reported and stored under
+    # @param columns - The number of enemies in each row of the wave
+    # @param rows - The number of rows of enemies in the wave
+    # @param projectiles - The number of projectiles kept in play on every frame, on top of the ones that are fired
+    # @param stars - The number of stars kept on the screen on every frame
+    # @param fire_multiplier - The enemies' fire multiplier. The game uses 20 and lower numbers fire more often
+    def __init__(self, name, columns=10, rows=6, projectiles=0, stars=0, fire_multiplier=20):
+        self.name = name
+        self.columns = columns
+        self.rows = rows
+        self.projectiles = projectiles
+        self.stars = stars
+        self.fire_multiplier = fire_multiplier
+
+    # Creates a headless game set up for the scenario. The player has so many lives that the game is never lost while
+    # it is being timed
+    # @param seed - The seed for the game
+    # @param arrays - Keeps the projectiles in NumPy arrays
+    # @param dirty - Draws with dirty rectangles instead of flipping the whole screen
+    def create(self, seed, arrays, dirty):
+        balance = Balance(shot_multiplier=self.fire_multiplier, columns=self.columns, rows=self.rows, lives=10 ** 6)
+        return Game(headless=True, seed=seed, controller=ChasePlayer(), render=True, arrays=arrays, dirty=dirty,
+                    balance=balance)
+
+    # Keeps the game going and adds projectiles and stars until the game has as many as the scenario asks for
+    # @param game - The game to fill
+    def top_up(self, game):
+        # A cleared wave is replaced with a new one, so every frame is timed with the scenario's enemies
+        if game.done:
+            game.build_wave(self.columns, self.rows, game.balance.formations)
+            game.done = False
+            game.won = None
+        rng = game.random
+        for i in range(len(game.projectiles), self.projectiles):
+            # Half the projectiles are the player's and half are the enemies', fired down. The player's are fired
+            # down below the wave too, so they are checked against the enemies every frame without clearing the wave
+            if i % 2 == 0:
+                game.fire([rng.randint(0, 596), rng.randint(400, 690)], [0, 4], True)
+            else:
+                game.fire([rng.randint(0, 596), rng.randint(0, 300)], [rng.randint(-2, 2), 3], False)
+        for i in range(len(game.stars), self.stars):
+            game.add_star(rng.randint(0, 700))
+
+
+# The scenarios that are run by default
+SCENARIOS = [
+    Scenario('default'),
+    Scenario('large-wave', columns=30, rows=20),
+    Scenario('projectiles', projectiles=2000),
+    Scenario('star-field', stars=1500),
+    Scenario('heavy-fire', fire_multiplier=1),
+    Scenario('everything', columns=30, rows=20, projectiles=2000, stars=1500, fire_multiplier=1),
+]
+
+
+# Plays a scenario for a number of frames as fast as possible and returns the time each frame took in nanoseconds
+# @param scenario - The scenario to play
+# @param frames - The number of frames to play
+# @param seed - The seed for the game
+# @param arrays - Keeps the projectiles in NumPy arrays
+# @param dirty - Draws with dirty rectangles instead of flipping the whole screen
+def play(scenario, frames, seed, arrays, dirty):
+    game = scenario.create(seed, arrays, dirty)
+    times = []
+    for i in range(0, frames):
+        # Filling the game back up is not part of the frame, so it is left out of the time
+        scenario.top_up(game)
+        # The game can only stop if a scenario lets it, which would leave the rest of the frames timing nothing
+        if game.done:
+            raise RuntimeError('The %s scenario ended on frame %d' % (scenario.name, game.frame))
+        start = time.perf_counter_ns()
+        game.step(game.controller(game))
+        game.draw()
+        times.append(time.perf_counter_ns() - start)
+    return times
+
+
+# Returns a percentile of a sorted list of times, using the nearest rank
+# @param times - The sorted times
+# @param percent - The percentile to find
+def percentile(times, percent):
+    return times[min(len(times) - 1, max(0, int(math.ceil(len(times) * percent / 100)) - 1))]
+
+
+# Runs a scenario and returns its frame rate, frame time percentiles in milliseconds and peak memory in kilobytes
+# @param scenario - The scenario to run
+# @param frames - The number of frames to time
+# @param seed - The seed for the game
+# @param arrays - Keeps the projectiles in NumPy arrays
+# @param dirty - Draws with dirty rectangles instead of flipping the whole screen
+# @param memory - Whether to measure the peak memory, which plays the scenario a second time
+def measure(scenario, frames, seed, arrays, dirty, memory):
+    times = sorted(play(scenario, frames, seed, arrays, dirty))
+    result = {'fps': len(times) * 1e9 / sum(times),
+              'p50_ms': percentile(times, 50) / 1e6,
+              'p95_ms': percentile(times, 95) / 1e6,
+              'p99_ms': percentile(times, 99) / 1e6,
+              'max_ms': times[-1] / 1e6}
+    if memory:
+        # Tracing memory slows the game down a lot, so the memory is measured on a separate run of the same game
+        tracemalloc.start()
+        play(scenario, frames, seed, arrays, dirty)
+        result['peak_kb'] = tracemalloc.get_traced_memory()[1] / 1024
+        tracemalloc.stop()
+    return result
+
+
+# Compares results with the ones from the last run and returns the scenarios that got slower
+# @param results - The results of this run
+# @param baseline - The results of the last run
+# @param threshold - How much slower, as a fraction, a scenario must be to count as a regression
+def regressions(results, baseline, threshold):
+    slower = []
+    for name, result in results.items():
+        old = baseline.get(name)
+        if old is None:
+            continue
+        if result['fps'] < old['fps'] * (1 - threshold) or result['p99_ms'] > old['p99_ms'] * (1 + threshold):
+            slower.append(name)
+    return slower
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Times the game loop on scripted stress scenarios')
+    parser.add_argument('--scenarios', nargs='+', default=[s.name for s in SCENARIOS],
+                        choices=[s.name for s in SCENARIOS], help='scenarios to run')
+    parser.add_argument('--frames', type=int, default=600, help='number of frames to time in each scenario')
+    parser.add_argument('--seed', type=int, default=1, help='seed for every game')
+    parser.add_argument('--arrays', action='store_true', help='keep the projectiles in NumPy arrays')
+    parser.add_argument('--dirty', action='store_true', help='draw with dirty rectangles')
+    parser.add_argument('--no-memory', action='store_true', help='skip measuring peak memory')
+    parser.add_argument('--baseline', default='.benchmarks.json',
+                        help='file the results are compared with and then saved to')
+    parser.add_argument('--no-save', action='store_true', help='compare with the baseline without replacing it')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='fraction a scenario has to slow down by to be flagged as a regression')
+    args = parser.parse_args()
+    # Results are stored under the scenario name and the options it was run with
+    suffix = ('+arrays' if args.arrays else '') + ('+dirty' if args.dirty else '')
+    results = {}
+    print('%-24s %10s %9s %9s %9s %9s %10s' % ('scenario', 'fps', 'p50 ms', 'p95 ms', 'p99 ms', 'max ms',
+                                             'peak kB'))
+    for scenario in SCENARIOS:
+        if scenario.name not in args.scenarios:
+            continue
+        name = scenario.name + suffix
+        result = measure(scenario, args.frames, args.seed, args.arrays, args.dirty, not args.no_memory)
+        results[name] = result
+        print('%-24s %10.1f %9.3f %9.3f %9.3f %9.3f %10s' % (
+            name, result['fps'], result['p50_ms'], result['p95_ms'], result['p99_ms'], result['max_ms'],
+            '%.0f' % result['peak_kb'] if 'peak_kb' in result else '-'))
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    slower = regressions(results, baseline, args.threshold)
+    for name in slower:
+        print('REGRESSION: %s is slower than the last run (%.1f fps, p99 %.3f ms before)' % (
+            name, baseline[name]['fps'], baseline[name]['p99_ms']))
+    if not args.no_save:
+        baseline.update(results)
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+    sys.exit(1 if slower else 0)
@@ -0,0 +1,77 @@
+import argparse
+import time
+
+import pygame
+
+from Gallaga import Enemy, Formation, Game
+
+
+# Fills a headless game with enemies and projectiles at random positions
+# @param game - The game to fill
+# @param count - The number of enemies and the number of projectiles to add
+def populate(game, count):
+    game.enemies.empty()
+    game.projectiles.empty()
+    # The enemies are put in a single formation, which keeps the grid the game checks projectiles against
+    formation = Formation()
+    game.formations = [formation]
+    for i in range(0, count):
+        enemy = Enemy([200, 0, 0], [game.random.randint(0, 580), game.random.randint(0, 680)])
+        game.enemies.add(enemy)
+        formation.add(enemy, i)
+        # Half the projectiles belong to the player and half to the enemies
+        position = [game.random.randint(0, 596), game.random.randint(0, 690)]
+        game.fire(position, [0, -4], i % 2 == 0)
+
+
+# Checks every projectile against every enemy, the way the game did before it used a SpatialHash
+# @param game - The game to check
+def brute_force(game):
+    hits = 0
+    for p in game.projectiles:
+        if p.friendly and pygame.sprite.spritecollideany(p, game.enemies):
+            hits += 1
+    return hits
+
+
+# Checks every projectile against the formations' grids, the way the game does, without removing anything that
+# was hit. The grids are kept up to date as enemies are added and removed, so nothing is built here
+# @param game - The game to check
+def spatial_hash(game):
+    hits = 0
+    for p in game.projectiles:
+        if p.friendly and game.enemy_at(p.rect):
+            hits += 1
+    return hits
+
+
+# Returns the average time in milliseconds one pass of a collision check takes
+# @param check - The collision check to time
+# @param game - The game to check
+# @param frames - The number of times to run the check
+def time_check(check, game, frames):
+    start = time.perf_counter()
+    for i in range(0, frames):
+        check(game)
+    return (time.perf_counter() - start) * 1000 / frames
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Times collision checks with thousands of entities')
+    parser.add_argument('--counts', type=int, nargs='+', default=[100, 500, 1000, 2000, 4000],
+                        help='numbers of enemies (and projectiles) to try')
+    parser.add_argument('--frames', type=int, default=20, help='number of frames to time at each count')
+    parser.add_argument('--skip-brute-force', action='store_true', help='only time the spatial hash')
+    args = parser.parse_args()
+    print('%10s %14s %14s %18s' % ('entities', 'hash ms', 'brute ms', 'hash us/entity'))
+    for count in args.counts:
+        game = Game(headless=True, seed=count, render=False)
+        populate(game, count)
+        # Both checks have to find the same hits
+        hits = spatial_hash(game)
+        hash_ms = time_check(spatial_hash, game, args.frames)
+        brute_ms = float('nan')
+        if not args.skip_brute_force:
+            assert brute_force(game) == hits
+            brute_ms = time_check(brute_force, game, args.frames)
+        print('%10d %14.3f %14.3f %18.3f' % (count * 2, hash_ms, brute_ms, hash_ms * 1000 / (count * 2)))
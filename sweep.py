@@ -0,0 +1,170 @@
+import argparse
+import csv
+import itertools
+import multiprocessing
+import os
+import statistics
+import time
+
+# pyarrow is only needed to write Parquet files, so sweeps can still be written to CSV without it
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+from Gallaga import Balance, ChasePlayer, Game
+
+# SDL catches SIGTERM in every process that starts it, which stops the pool from ending its worker processes, so
+# SDL is told to leave the signals alone. The workers get this setting from the main process
+os.environ.setdefault('SDL_NO_SIGNAL_HANDLERS', '1')
+
+# The columns written for every game, after one column for each Balance setting
+COLUMNS = Balance.NAMES + ('seed', 'won', 'score', 'lives_left', 'frames', 'frames_to_clear', 'frame_us')
+
+
+# Plays one headless game with the computer player and returns a row of results
+# @param task - The Balance settings as a dictionary, the seed and the most frames the game is allowed to last
+def play(task):
+    settings, seed, max_frames = task
+    balance = Balance(**settings)
+    game = Game(headless=True, seed=seed, controller=ChasePlayer(), max_frames=max_frames, balance=balance)
+    # The CPU time of this process is used so other processes running at the same time don't change the frame cost
+    start = time.process_time()
+    result = game.run()
+    elapsed = time.process_time() - start
+    # Every setting is written, including the ones that were not swept
+    row = balance.as_dict()
+    row.update({'seed': seed, 'won': result.won, 'score': result.score, 'lives_left': result.lives,
+                'frames': result.frames, 'frames_to_clear': result.frames if result.won else None,
+                'frame_us': elapsed * 1e6 / max(result.frames, 1)})
+    return row
+
+
+# Class that writes rows of results to a CSV file as they come in
+class CsvWriter:
+    # Constructor for the CsvWriter class
+    # @param path - The file to write to
+    def __init__(self, path):
+        self.file = open(path, 'w', newline='')
+        self.writer = csv.DictWriter(self.file, COLUMNS)
+        self.writer.writeheader()
+
+    # Writes a row of results
+    # @param row - The results of one game
+    def write(self, row):
+        self.writer.writerow(row)
+        # Each row goes to the file straight away, so a sweep that is stopped early keeps the games it finished
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+# Class that writes rows of results to a Parquet file, a row group at a time
+class ParquetWriter:
+    # Constructor for the ParquetWriter class
+    # @param path - The file to write to
+    # @param batch - The number of rows in each row group
+    def __init__(self, path, batch=1000):
+        if pyarrow is None:
+            raise ImportError('Writing Parquet files needs pyarrow. Write to a .csv file instead')
+        self.path = path
+        self.batch = batch
+        # The schema is set out once rather than worked out from the first batch, which would give frames_to_clear no
+        # type if no game in that batch cleared its wave, and then turn away the batches after it
+        types = {'won': pyarrow.bool_(), 'frame_us': pyarrow.float64()}
+        self.schema = pyarrow.schema([pyarrow.field(c, types.get(c, pyarrow.int64()), nullable=True) for c in COLUMNS])
+        self.rows = []
+        self.writer = None
+
+    # Writes a row of results
+    # @param row - The results of one game
+    def write(self, row):
+        self.rows.append(row)
+        if len(self.rows) >= self.batch:
+            self.flush()
+
+    # Writes the rows that have come in since the last row group
+    def flush(self):
+        if not self.rows:
+            return
+        table = pyarrow.Table.from_pydict(dict((c, [row[c] for row in self.rows]) for c in COLUMNS), schema=self.schema)
+        if self.writer is None:
+            self.writer = pyarrow.parquet.ParquetWriter(self.path, self.schema)
+        self.writer.write_table(table)
+        self.rows = []
+
+    def close(self):
+        self.flush()
+        if self.writer is not None:
+            self.writer.close()
+
+
+# Reads a list of settings like "shot_multiplier=10,20,40" into a dictionary of the values to try for each setting
+# @param params - The settings from the command line
+def parse_grid(params):
+    grid = {}
+    for param in params:
+        name, _, values = param.partition('=')
+        if name not in Balance.NAMES:
+            raise SystemExit('Unknown setting %r. Choose from: %s' % (name, ', '.join(Balance.NAMES)))
+        grid[name] = [int(v) for v in values.split(',')]
+    return grid
+
+
+# Prints the win rate, score, frames to clear and frame cost of every combination of settings
+# @param rows - The results of every game
+# @param names - The settings that were swept
+def summarize(rows, names):
+    groups = {}
+    for row in rows:
+        groups.setdefault(tuple(row[n] for n in names), []).append(row)
+    print('%-30s %6s %8s %10s %10s %14s %10s' % (' '.join(names) or 'settings', 'games', 'win %', 'score p50',
+                                                 'score p90', 'clear frames', 'frame us'))
+    for key in sorted(groups):
+        group = groups[key]
+        scores = sorted(r['score'] for r in group)
+        cleared = [r['frames_to_clear'] for r in group if r['won']]
+        print('%-30s %6d %8.1f %10d %10d %14s %10.1f' % (
+            ' '.join(str(k) for k in key) or 'default', len(group), 100.0 * len(cleared) / len(group),
+            scores[len(scores) // 2], scores[min(len(scores) - 1, len(scores) * 9 // 10)],
+            '%.0f' % statistics.mean(cleared) if cleared else '-', statistics.mean(r['frame_us'] for r in group)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Plays many seeded games in parallel over a grid of balance settings')
+    parser.add_argument('--param', action='append', default=[], metavar='NAME=V1,V2,...',
+                        help='a Balance setting and the values to try. Can be given more than once')
+    parser.add_argument('--seeds', type=int, default=100, help='number of games to play for each combination')
+    parser.add_argument('--first-seed', type=int, default=0, help='seed of the first game of each combination')
+    parser.add_argument('--max-frames', type=int, default=36000,
+                        help='stop games that last longer than this many frames')
+    parser.add_argument('--processes', type=int, default=os.cpu_count(), help='number of games to play at once')
+    parser.add_argument('--out', default='sweep.csv', help='file to write the results to, .csv or .parquet')
+    args = parser.parse_args()
+    grid = parse_grid(args.param)
+    names = list(grid)
+    # Every combination of settings is played with the same seeds, so the combinations can be compared fairly
+    tasks = [(dict(zip(names, values)), seed, args.max_frames)
+             for values in itertools.product(*(grid[n] for n in names))
+             for seed in range(args.first_seed, args.first_seed + args.seeds)]
+    writer = ParquetWriter(args.out) if args.out.endswith('.parquet') else CsvWriter(args.out)
+    rows = []
+    start = time.perf_counter()
+    # Games are handed out a few at a time so each process stays busy without waiting on the others
+    chunksize = max(1, len(tasks) // (args.processes * 8))
+    try:
+        with multiprocessing.Pool(args.processes) as pool:
+            for row in pool.imap_unordered(play, tasks, chunksize):
+                writer.write(row)
+                rows.append(row)
+            # The workers are left to finish on their own. Leaving the with block would terminate them instead
+            pool.close()
+            pool.join()
+    finally:
+        writer.close()
+    elapsed = time.perf_counter() - start
+    print('%d games in %.1f seconds (%.0f games per minute) on %d processes, written to %s' % (
+        len(rows), elapsed, len(rows) * 60 / elapsed, args.processes, args.out))
+    summarize(rows, names)
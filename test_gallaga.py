@@ -0,0 +1,232 @@
+import json
+import os
+import random
+
+# The dummy drivers let the tests run on a machine without a display or a sound card
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+
+import pygame
+import pytest
+
+from Gallaga import (Balance, ChasePlayer, Enemy, FireScheduler, Game, Replay, ReplayPlayback, SpatialHash, numpy,
+                     read_varint, unzigzag, write_varint, zigzag)
+
+
+# Stands in for a Game so the FireScheduler can be run on its own. Shots are counted instead of fired
+class ShotCounter:
+    # @param enemies - The number of enemies
+    # @param seed - The seed of the random number generator
+    def __init__(self, enemies, seed):
+        self.enemies = pygame.sprite.Group(Enemy([200, 0, 0], [i * 30, 40]) for i in range(0, enemies))
+        self.random = random.Random(seed)
+        self.balance = Balance()
+        self.frame = 0
+        self.shots = 0
+
+    def fire(self, position, vector, friendly):
+        self.shots += 1
+
+
+# Each enemy should shoot 1 time in N * multiplier + 1 frames, the same chance the game had before the scheduler
+@pytest.mark.parametrize('enemies, multiplier', [(1, 20), (10, 20), (60, 20), (10, 5)])
+def test_fire_rate(enemies, multiplier):
+    game = ShotCounter(enemies, seed=enemies * multiplier)
+    scheduler = FireScheduler(multiplier)
+    frames = 200000
+    for frame in range(0, frames):
+        game.frame = frame
+        scheduler.update(game)
+    expected = frames * enemies / (enemies * multiplier + 1)
+    # Allows for 4 standard deviations of a Poisson count
+    assert abs(game.shots - expected) < 4 * expected ** 0.5
+
+
+# The scheduler works every shot out again when the number of enemies changes, and destroyed enemies never shoot
+def test_fire_scheduler_skips_destroyed_enemies():
+    game = ShotCounter(5, seed=1)
+    scheduler = FireScheduler(1)
+    scheduler.update(game)
+    for e in game.enemies.sprites():
+        e.kill()
+    for frame in range(1, 200):
+        game.frame = frame
+        scheduler.update(game)
+    shots = game.shots
+    game.frame = 200
+    scheduler.update(game)
+    assert game.shots == shots
+    assert scheduler.queue == []
+
+
+# The array-backed projectiles have to play exactly the same game as the sprite pool
+@pytest.mark.skipif(numpy is None, reason='the array-backed projectile store needs NumPy')
+@pytest.mark.parametrize('seed', [1, 2, 3])
+def test_sprites_and_arrays_play_the_same_game(seed):
+    sprites = Game(headless=True, seed=seed, controller=ChasePlayer()).run()
+    arrays = Game(headless=True, seed=seed, controller=ChasePlayer(), arrays=True).run()
+    assert (sprites.score, sprites.lives, sprites.frames, sprites.won) == \
+        (arrays.score, arrays.lives, arrays.frames, arrays.won)
+
+
+# Returns the rectangles used to probe for collisions, covering the whole screen including its edges
+def probes(rng, count):
+    return [pygame.Rect(rng.randint(-10, 600), rng.randint(-10, 700), rng.randint(1, 30), rng.randint(1, 30))
+            for i in range(0, count)]
+
+
+# Holds a rectangle so pygame.sprite.spritecollideany can be used to check it
+def probe_sprite(rect):
+    sprite = pygame.sprite.Sprite()
+    sprite.rect = rect
+    return sprite
+
+
+def test_spatial_hash_matches_spritecollideany():
+    rng = random.Random(3)
+    enemies = pygame.sprite.Group(Enemy([200, 0, 0], [rng.randint(0, 580), rng.randint(0, 680)])
+                                  for i in range(0, 300))
+    grid = SpatialHash()
+    grid.build(enemies)
+    # Killed enemies are skipped even though they are still in the grid
+    for e in enemies.sprites()[::7]:
+        e.kill()
+    for rect in probes(rng, 2000):
+        assert grid.first(rect) is pygame.sprite.spritecollideany(probe_sprite(rect), enemies)
+
+
+# The formation's grid is kept where the enemies would be if the formation had not moved, and enemies are taken out
+# of it when they are destroyed, so it has to keep finding the same enemy as the group as the formation moves
+def test_formation_grid_matches_spritecollideany():
+    game = Game(headless=True, seed=4, render=False)
+    game.build_wave(10, 6)
+    rng = random.Random(4)
+    for frame in range(0, 400):
+        for f in game.formations:
+            f.update()
+        if frame % 10 == 0:
+            rng.choice(game.enemies.sprites()).kill()
+        for rect in probes(rng, 20):
+            assert game.enemy_at(rect) is pygame.sprite.spritecollideany(probe_sprite(rect), game.enemies)
+
+
+# Formations turn around on their own, and the enemy found first is still the first one in the group when more than
+# one formation is checked
+def test_formations_move_on_their_own():
+    game = Game(headless=True, seed=5, render=False)
+    game.build_wave(10, 6, formations=2)
+    top, bottom = game.formations
+    assert len(top) == len(bottom) == 30
+    rng = random.Random(5)
+    directions = set()
+    for frame in range(0, 400):
+        for f in game.formations:
+            f.update()
+        directions.add((top.direction, bottom.direction))
+        if frame % 10 == 0:
+            rng.choice(game.enemies.sprites()).kill()
+        # Probes as tall as the wave collide with enemies in both formations
+        for rect in probes(rng, 20) + [pygame.Rect(rng.randint(0, 580), 0, 30, 400)]:
+            assert game.enemy_at(rect) is pygame.sprite.spritecollideany(probe_sprite(rect), game.enemies)
+    assert (1, -1) in directions and (-1, 1) in directions
+
+
+# A removed sprite is taken out of every cell it overlapped
+def test_spatial_hash_remove():
+    enemy = Enemy([200, 0, 0], [100, 100])
+    # The enemy has to be in a group to count as alive
+    group = pygame.sprite.Group(enemy)
+    grid = SpatialHash()
+    grid.add(enemy, 0)
+    assert grid.first(pygame.Rect(105, 105, 2, 2)) is enemy
+    grid.remove(enemy)
+    assert len(grid) == 0
+    assert grid.cells == {}
+    assert grid.first(pygame.Rect(105, 105, 2, 2)) is None
+
+
+def test_varint_and_zigzag_round_trip():
+    numbers = [0, 1, 127, 128, 300, 2 ** 32 - 1, 2 ** 64]
+    out = bytearray()
+    for n in numbers:
+        write_varint(out, n)
+    position = 0
+    for n in numbers:
+        value, position = read_varint(bytes(out), position)
+        assert value == n
+    assert position == len(out)
+    for n in [0, -1, 1, -2, 2, -2 ** 31, 2 ** 31]:
+        assert zigzag(n) >= 0
+        assert unzigzag(zigzag(n)) == n
+
+
+# Plays a recorded game with the computer player and returns its result and the replay
+def record(seed, balance=None):
+    game = Game(headless=True, seed=seed, controller=ChasePlayer(), record=True, balance=balance)
+    return game.run(), game.recording
+
+
+@pytest.mark.parametrize('seed', [1, 9])
+def test_replay_round_trip(seed):
+    balance = Balance(shot_multiplier=30, lives=4)
+    result, replay = record(seed, balance)
+    decoded = Replay.decode(replay.encode())
+    assert decoded.seed == replay.seed
+    assert decoded.runs == replay.runs
+    assert decoded.frames == replay.frames == result.frames
+    assert decoded.balance.as_dict() == balance.as_dict()
+    played = ReplayPlayback(decoded).run()
+    assert (played.score, played.lives, played.frames, played.won) == \
+        (result.score, result.lives, result.frames, result.won)
+
+
+# Seeking to a frame has to give the same game as playing up to it, whether it goes forwards or back
+def test_replay_seek():
+    result, replay = record(2)
+
+    def state(game):
+        return (game.frame, game.score, game.lives, game.ship.rect.topleft,
+                [e.rect.topleft for e in game.enemies], sorted(p.rect.topleft for p in game.projectiles))
+
+    expected = {}
+    playback = ReplayPlayback(replay, interval=100)
+    targets = [0, 1, 99, 100, 101, 457, replay.frames]
+    for frame in sorted(targets):
+        playback.seek(frame)
+        expected[frame] = state(playback.game)
+    for frame in [457, 99, replay.frames, 1, 101, 0, 100]:
+        playback.seek(frame)
+        assert state(playback.game) == expected[frame]
+
+
+@pytest.mark.parametrize('data', [b'', b'GRP', b'GRPL', b'NOPE\x03', b'GRPL\x02\x02\x00\x00'])
+def test_replay_decode_rejects_bad_files(data):
+    with pytest.raises(ValueError):
+        Replay.decode(data)
+
+
+def test_replay_decode_rejects_damaged_runs():
+    result, replay = record(3)
+    data = replay.encode()
+    with pytest.raises(ValueError):
+        Replay.decode(data[:-4])
+    # A settings count larger than the game knows about is turned away instead of misreading the runs
+    header = bytearray(Replay.MAGIC)
+    header.append(Replay.VERSION)
+    write_varint(header, 0)
+    write_varint(header, len(Balance.NAMES) + 1)
+    with pytest.raises(ValueError):
+        Replay.decode(bytes(header) + bytes(len(Balance.NAMES) + 1) + data[-4:])
+
+
+# Every frame played back is timed, so a replay can be played again to profile it
+def test_profiled_playback_exports_every_frame(tmp_path):
+    game = Game(headless=True, seed=4, controller=ChasePlayer(), record=True, max_frames=300)
+    game.run()
+    playback = ReplayPlayback(game.recording, profile=True)
+    playback.run()
+    path = tmp_path / 'trace.json'
+    playback.game.profiler.export(str(path), 'json')
+    frames = json.loads(path.read_text())
+    assert [f['frame'] for f in frames] == list(range(0, 300))
+    assert all(f['enemy_fire'] >= 0 for f in frames)